@@ -32,3 +32,9 @@ class SourceAdmin(admin.ModelAdmin):
 class HarvestingStatusAdmin(admin.ModelAdmin):
     list_display = (
         'source', 'create_date', 'created', 'updated', 'deleted', 'processed', 'total_records', 'error', 'session_id')
+
+
+@admin.register(models.QuarantinedRecord)
+class QuarantinedRecordAdmin(admin.ModelAdmin):
+    list_filter = ('create_date',)
+    list_display = ('source_file', 'session_id', 'offset', 'length', 'message', 'create_date')
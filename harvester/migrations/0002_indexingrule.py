@@ -0,0 +1,30 @@
+# Generated by Django 2.0.2 on 2026-10-18 05:48
+
+from django.db import migrations, models
+import harvester.models
+
+
+# IndexingRule and GZipField of RecordContent were in models before migrations of harvesting checkpoints,
+# databases where they exist already apply this migration with --fake
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('harvester', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndexingRule',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=128)),
+                ('content', models.TextField(max_length=102400)),
+                ('params', models.TextField(blank=True, max_length=10240)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='recordcontent',
+            name='content',
+            field=harvester.models.GZipField(max_length=102400),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 2.0.2 on 2026-10-18 05:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('harvester', '0002_indexingrule'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HarvestingCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_id', models.BigIntegerField(db_index=True)),
+                ('offset', models.BigIntegerField(default=0)),
+                ('index', models.IntegerField(default=0)),
+                ('processed', models.IntegerField(default=0)),
+                ('created', models.IntegerField(default=0)),
+                ('updated', models.IntegerField(default=0)),
+                ('deleted', models.IntegerField(default=0)),
+                ('total_records', models.IntegerField(default=0)),
+                ('finished', models.BooleanField(default=False)),
+                ('update_date', models.DateTimeField(auto_now=True)),
+                ('source_file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='harvester.SourceRecordsFile')),
+            ],
+            options={
+                'unique_together': {('source_file', 'session_id')},
+            },
+        ),
+    ]
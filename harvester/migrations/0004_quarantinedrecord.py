@@ -0,0 +1,30 @@
+# Generated by Django 2.0.2 on 2026-10-18 06:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('harvester', '0003_harvestingcheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuarantinedRecord',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_id', models.BigIntegerField(db_index=True)),
+                ('offset', models.BigIntegerField()),
+                ('length', models.BigIntegerField()),
+                ('content', models.BinaryField(max_length=99999)),
+                ('message', models.TextField(blank=True, max_length=2048)),
+                ('create_date', models.DateTimeField(auto_now_add=True)),
+                ('source_file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='harvester.SourceRecordsFile')),
+            ],
+            options={
+                'unique_together': {('source_file', 'session_id', 'offset')},
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.0.2 on 2026-10-18 06:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('harvester', '0004_quarantinedrecord'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StagingRecord',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_id', models.BigIntegerField()),
+                ('record_id', models.CharField(max_length=32)),
+                ('original_id', models.CharField(blank=True, max_length=255)),
+                ('hash', models.CharField(max_length=32)),
+                ('offset', models.BigIntegerField()),
+                ('length', models.IntegerField()),
+                ('content', models.BinaryField(null=True)),
+                ('action', models.CharField(max_length=1, null=True)),
+                ('source_file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='harvester.SourceRecordsFile')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='stagingrecord',
+            index=models.Index(fields=['source_file', 'session_id', 'record_id'], name='harvester_staging_record_idx'),
+        ),
+    ]
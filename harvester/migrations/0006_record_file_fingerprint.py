@@ -0,0 +1,38 @@
+# Generated by Django 2.0.2 on 2026-10-18 06:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('harvester', '0005_stagingrecord'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='harvestingcheckpoint',
+            name='file_checksum',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='harvestingcheckpoint',
+            name='file_mtime',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='harvestingcheckpoint',
+            name='file_records',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='harvestingcheckpoint',
+            name='file_size',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='record',
+            name='file_id',
+            field=models.IntegerField(db_index=True, null=True),
+        ),
+    ]
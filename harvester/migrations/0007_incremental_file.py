@@ -0,0 +1,28 @@
+# Generated by Django 2.0.2 on 2026-10-18 06:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('harvester', '0006_record_file_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='harvestingcheckpoint',
+            name='prefix_checksum',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='harvestingcheckpoint',
+            name='prefix_length',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='sourcerecordsfile',
+            name='incremental',
+            field=models.BooleanField(default=False),
+        ),
+    ]
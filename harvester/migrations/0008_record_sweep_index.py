@@ -0,0 +1,17 @@
+# Generated by Django 2.0.2 on 2026-10-18 06:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('harvester', '0007_incremental_file'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='record',
+            index=models.Index(fields=['source', 'deleted', 'session_id'], name='harvester_record_sweep_idx'),
+        ),
+    ]
@@ -1,17 +1,31 @@
 # -*- coding: utf-8 -*-
+import collections
 import datetime as dt
 import gzip
 import hashlib
+import multiprocessing
+import queue
+import threading
 import time
+import traceback
 import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
-from django.db import models, transaction
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.db.models import Case, Value, When
 from django.utils import timezone
-from django.core.exceptions import ValidationError
+from django.core.exceptions import ImproperlyConfigured, ValidationError
 
-from junimarc.iso2709.reader import Reader
-from junimarc.json.junimarc import record_to_json
-from junimarc.record import ControlField
+from junimarc.compression import open_file
+from junimarc.iso2709.constants import MAX_RECORD_LENGTH
+from junimarc.iso2709.index import get_records_index
+from junimarc.iso2709.reader import RECORD_TERMINATOR, Reader, make_batches
+from junimarc.binary.junimarc import is_binary, record_from_binary
+from junimarc.json.junimarc import record_from_json
+
+from . import record_workers
+from .record_workers import RECORD_CODECS, RecordPreparer, compress_content
 
 FORMATS = {
     'iso2709': 'iso2709',
@@ -36,6 +50,8 @@ class Source(models.Model):
 FORMAT_CHOICES = [(k, v) for k, v in FORMATS.items()]
 SCHEMA_CHOICES = [(k, v) for k, v in SCHEMAS.items()]
 
+FINGERPRINT_CHUNK_SIZE = 1024 * 1024
+
 
 class SourceRecordsFile(models.Model):
     source = models.ForeignKey(Source, on_delete=models.CASCADE)
@@ -43,6 +59,8 @@ class SourceRecordsFile(models.Model):
     format = models.CharField(max_length=64, default=FORMAT_CHOICES[0][0], choices=FORMAT_CHOICES)
     schema = models.CharField(max_length=64, default=SCHEMA_CHOICES[0][0], choices=SCHEMA_CHOICES)
     encoding = models.CharField(max_length=64, default='utf-8')
+    # records are only appended to file, new ones are collected from the end of the last harvest
+    incremental = models.BooleanField(default=False)
 
     def __str__(self):
         return str(self.source)
@@ -71,6 +89,51 @@ class SourceRecordsFile(models.Model):
     def get_update_date(self):
         return dt.datetime.fromtimestamp(os.path.getmtime(self.file_uri))
 
+    # (size, mtime in nanoseconds) of file
+    def get_stat(self):
+        stat = os.stat(self.file_uri)
+        return stat.st_size, stat.st_mtime_ns
+
+    # (encoding, extended subfield code, codec) of RecordPreparer of file, records are decoded
+    # with default encoding of Reader
+    def get_preparer_args(self):
+        extended_subfield_code = ''
+        if self.schema == SCHEMAS['rusmarc']:
+            extended_subfield_code = '1'
+        return Reader(None).encoding, extended_subfield_code, get_record_codec()
+
+    # format, schema, decoding options and codec are in checksums as harvested contents depend on them
+    def make_checksum(self):
+        checksum = hashlib.md5(('%s:%s:' % (self.format, self.schema)).encode('utf-8'))
+        checksum.update(record_workers.get_hash_prefix(*self.get_preparer_args()))
+        return checksum
+
+    # (records, checksum, end offset) of length bytes of file from offset or of the rest of file when length is None,
+    # copy of given checksum is continued, new one is started without it, checksum is None if file is shorter.
+    # Records are counted by terminators, compressed file is read uncompressed as reader does
+    def read_checksum(self, offset=0, length=None, checksum=None):
+        records = 0
+        checksum = checksum.copy() if checksum is not None else self.make_checksum()
+        end = offset + length if length is not None else None
+        with open_file(self.file_uri) as fl:
+            if offset:
+                fl.seek(offset)
+            while end is None or offset < end:
+                chunk = fl.read(FINGERPRINT_CHUNK_SIZE if end is None else min(end - offset, FINGERPRINT_CHUNK_SIZE))
+                if not chunk:
+                    if end is not None:
+                        return records, None, offset
+                    break
+                records += chunk.count(RECORD_TERMINATOR)
+                checksum.update(chunk)
+                offset += len(chunk)
+        return records, checksum, offset
+
+    # (total records, checksum) of file in one read
+    def get_records_checksum(self):
+        total_records, checksum, end = self.read_checksum()
+        return total_records, checksum.hexdigest()
+
     def calculate_records_count(self):
         status = self.status()
         if status != 'ok':
@@ -99,21 +162,21 @@ class SourceRecordsFile(models.Model):
                 encoding=self.encoding,
                 extended_subfield_code=extended_subfield_code
             )
+            records_index = get_records_index(self.file_uri)
 
-            for record in reader.read():
-                if position_type == 'index':
-                    if reader.index == position:
-                        target_record = record
-                        break
-                    if reader.index > position:
-                        break
-
-                if position_type == 'offset':
-                    if reader.offset == position:
-                        target_record = record
-                        break
-                    if reader.offset > position:
-                        break
+            index = None
+            if position_type == 'index':
+                index = position
+            elif position_type == 'offset':
+                index = records_index.get_index(position)
+
+            record_position = None
+            if index is not None:
+                record_position = records_index.get_position(index)
+
+            if record_position is not None:
+                offset, length = record_position
+                target_record = reader.read_record(offset, length, index=index)
         else:
             return 'No handler for format ' + self.format
 
@@ -139,6 +202,66 @@ class HarvestingStatus(models.Model):
     message = models.TextField(max_length=2018)
 
 
+class HarvestingCheckpoint(models.Model):
+    source_file = models.ForeignKey(SourceRecordsFile, on_delete=models.CASCADE)
+    session_id = models.BigIntegerField(db_index=True)
+    offset = models.BigIntegerField(default=0)
+    index = models.IntegerField(default=0)
+    processed = models.IntegerField(default=0)
+    created = models.IntegerField(default=0)
+    updated = models.IntegerField(default=0)
+    deleted = models.IntegerField(default=0)
+    total_records = models.IntegerField(default=0)
+    finished = models.BooleanField(default=False)
+    update_date = models.DateTimeField(auto_now=True)
+    file_size = models.BigIntegerField(null=True)
+    # st_mtime_ns of file
+    file_mtime = models.BigIntegerField(null=True)
+    file_checksum = models.CharField(max_length=32, blank=True)
+    # not deleted records of file when it was collected
+    file_records = models.IntegerField(null=True)
+    # records up to prefix_length are collected, incremental harvest continues from there
+    prefix_length = models.BigIntegerField(null=True)
+    prefix_checksum = models.CharField(max_length=32, blank=True)
+
+    # (records, checksum) of file bytes read by this process by their length, file is read from the longest of them
+    # instead of from the beginning. They are not saved, resumed harvest reads file again
+    read_checksums = None
+
+    class Meta:
+        unique_together = ('source_file', 'session_id')
+
+    def add_read_checksum(self, length, records, checksum):
+        if self.read_checksums is None:
+            self.read_checksums = {}
+        self.read_checksums[length] = (records, checksum)
+
+    # (length, records, checksum) of the longest read bytes up to length, (0, 0, None) when nothing is read
+    def get_read_checksum(self, length):
+        lengths = [read_length for read_length in self.read_checksums or () if read_length <= length]
+        if not lengths:
+            return 0, 0, None
+        read_length = max(lengths)
+        return (read_length,) + self.read_checksums[read_length]
+
+    # file is not changed since checkpoint was created, so collecting can be resumed from its offset
+    def is_file_unchanged(self):
+        return (self.file_size, self.file_mtime) == self.source_file.get_stat()
+
+
+class QuarantinedRecord(models.Model):
+    source_file = models.ForeignKey(SourceRecordsFile, on_delete=models.CASCADE)
+    session_id = models.BigIntegerField(db_index=True)
+    offset = models.BigIntegerField()
+    length = models.BigIntegerField()
+    content = models.BinaryField(max_length=MAX_RECORD_LENGTH)
+    message = models.TextField(max_length=2048, blank=True)
+    create_date = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('source_file', 'session_id', 'offset')
+
+
 class Record(models.Model):
     id = models.CharField(primary_key=True, max_length=32)
     original_id = models.CharField(max_length=255, blank=True)
@@ -149,6 +272,13 @@ class Record(models.Model):
     create_date = models.DateTimeField(db_index=True)
     update_date = models.DateTimeField(db_index=True)
     deleted = models.BooleanField(default=False, db_index=True)
+    # SourceRecordsFile the record was last harvested from
+    file_id = models.IntegerField(null=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['source', 'deleted', 'session_id'], name='harvester_record_sweep_idx'),
+        ]
 
 
 class IndexingRule(models.Model):
@@ -160,12 +290,17 @@ class IndexingRule(models.Model):
         return self.name
 
 
+# value compressed before saving, GZipField stores it as is
+class GZipped(bytes):
+    pass
+
+
 class GZipField(models.BinaryField):
 
     def get_db_prep_value(self, value, connection, prepared=False):
         cleaned_value = value
-        if cleaned_value is not None:
-            cleaned_value = gzip.compress(cleaned_value, compresslevel=7)
+        if cleaned_value is not None and not isinstance(cleaned_value, GZipped):
+            cleaned_value = compress_content(cleaned_value)
         return super().get_db_prep_value(cleaned_value, connection, prepared)
 
     def to_python(self, value):
@@ -179,180 +314,973 @@ class RecordContent(models.Model):
     record = models.OneToOneField(Record, primary_key=True, on_delete=models.CASCADE)
     content = GZipField(max_length=100 * 1024)
 
+    def get_record(self):
+        return load_record(self.content)
 
-def _get_record_id(jrecord, dump):
-    fields_001 = jrecord.get_fields('001')
-    record_id = ''
-    hash = hashlib.md5(dump).hexdigest()
-    for field_001 in fields_001:
-        if not isinstance(field_001, ControlField):
-            continue
-        data = field_001.get_data()
-        if data:
-            record_id = data
-            break
 
-    if record_id:
-        return hashlib.md5(record_id.encode('utf-8')).hexdigest(), record_id, hash
+STAGING_ACTION_CREATE = 'c'
+STAGING_ACTION_UPDATE = 'u'
+STAGING_ACTION_REHASH = 'h'
 
-    return hash, record_id, hash
-
-
-def create_records(record_containers):
-    for record_container in record_containers:
-        Record.objects.bulk_create([record_container['record']])
-        RecordContent.objects.bulk_create([record_container['content']])
-
-
-def update_records(record_containers):
-    for record_container in record_containers:
-        record_container['record'].save()
-        record_content = record_container['content']
-        RecordContent.objects.filter(record_id=record_content.record_id).update(content=record_content.content)
 
+# records of file harvested by staging engine, merged into Record by set-based statements
+class StagingRecord(models.Model):
+    source_file = models.ForeignKey(SourceRecordsFile, on_delete=models.CASCADE)
+    session_id = models.BigIntegerField()
+    record_id = models.CharField(max_length=32)
+    original_id = models.CharField(max_length=255, blank=True)
+    hash = models.CharField(max_length=32)
+    offset = models.BigIntegerField()
+    length = models.IntegerField()
+    # content dump when it is made while reading, otherwise content is dumped from file at offset
+    content = models.BinaryField(null=True)
+    action = models.CharField(max_length=1, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['source_file', 'session_id', 'record_id'], name='harvester_staging_record_idx'),
+        ]
+
+
+# 'batch' reconciles records in python batch by batch, 'staging' loads whole file into StagingRecord
+# and merges it with set-based sql
+HARVEST_ENGINES = ('batch', 'staging')
+
+
+def get_harvest_engine():
+    engine = getattr(settings, 'HARVESTER_ENGINE', 'batch')
+    if engine not in HARVEST_ENGINES:
+        raise ImproperlyConfigured('Unknown HARVESTER_ENGINE %s, use one of %s' % (engine, ', '.join(HARVEST_ENGINES)))
+    return engine
+
+
+# codec of new RecordContent is set by HARVESTER_RECORD_CODEC setting,
+# contents are read by load_record whatever codec they were written with
+def get_record_codec():
+    codec = getattr(settings, 'HARVESTER_RECORD_CODEC', 'json')
+    if codec not in RECORD_CODECS:
+        raise ImproperlyConfigured(
+            'Unknown HARVESTER_RECORD_CODEC %s, use one of %s' % (codec, ', '.join(RECORD_CODECS)))
+    return codec
+
+
+def get_harvest_workers():
+    return getattr(settings, 'HARVESTER_WORKERS', 0)
+
+
+def get_harvest_sources_concurrency():
+    return getattr(settings, 'HARVESTER_SOURCES_CONCURRENCY', 1)
+
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def load_record(content):
+    content = bytes(content)
+    # GZipField values loaded from database are still compressed
+    if content[:len(GZIP_MAGIC)] == GZIP_MAGIC:
+        content = gzip.decompress(content)
+    if is_binary(content):
+        return record_from_binary(content)
+    return record_from_json(content.decode('utf-8'))
+
+
+# record container is dict of id, original_id, hash, content (dump, GZipped or None) and record_bytes,
+# model instances are built only for rows that are written
+def create_records(record_containers, source, session_id, now, file_id=None):
+    if not record_containers:
+        return
+
+    Record.objects.bulk_create([
+        Record(
+            id=record_container['id'],
+            original_id=record_container['original_id'],
+            hash=record_container['hash'],
+            source=source,
+            schema='junimarc',
+            session_id=session_id,
+            create_date=now,
+            update_date=now,
+            file_id=file_id,
+        ) for record_container in record_containers
+    ])
+    RecordContent.objects.bulk_create([
+        RecordContent(record_id=record_container['id'], content=record_container['content'])
+        for record_container in record_containers
+    ])
+
+
+# session_id or file_id is None when records keep their session or file
+def update_records(record_containers, now, session_id=None, file_id=None):
+    if not record_containers:
+        return
+
+    ids = [record_container['id'] for record_container in record_containers]
+    values = {
+        'hash': Case(
+            *[When(id=record_container['id'], then=Value(record_container['hash']))
+              for record_container in record_containers],
+            output_field=models.CharField()
+        ),
+        'update_date': now,
+        'deleted': False,
+    }
+    if session_id is not None:
+        values['session_id'] = session_id
+    if file_id is not None:
+        values['file_id'] = file_id
+    Record.objects.filter(id__in=ids).update(**values)
+
+    RecordContent.objects.filter(record_id__in=ids).delete()
+    RecordContent.objects.bulk_create([
+        RecordContent(record_id=record_container['id'], content=record_container['content'])
+        for record_container in record_containers
+    ])
+
+
+# records which stored hash is md5 of their json content, as hashes were before hashes of raw record bytes,
+# get new hash only, their content and update_date are kept
+def rehash_records(record_containers, session_id=None, file_id=None):
+    if not record_containers:
+        return
+
+    values = {
+        'hash': Case(
+            *[When(id=record_container['id'], then=Value(record_container['hash']))
+              for record_container in record_containers],
+            output_field=models.CharField()
+        ),
+    }
+    if session_id is not None:
+        values['session_id'] = session_id
+    if file_id is not None:
+        values['file_id'] = file_id
+    Record.objects.filter(id__in=[record_container['id'] for record_container in record_containers]).update(**values)
 
-def reset_records(records):
-    ids = set()
-    session_id = None
-    for record in records:
-        ids.add(record.id)
-        if not session_id:
-            session_id = record.session_id
 
+def reset_records(ids, session_id, file_id=None):
+    values = {}
     if session_id:
-        Record.objects.filter(id__in=ids).update(session_id=session_id)
+        values['session_id'] = session_id
+    if file_id is not None:
+        values['file_id'] = file_id
+    if ids and values:
+        Record.objects.filter(id__in=ids).update(**values)
 
 
-def process_records(record_containers, reset=True):
+# returns containers to create, containers to update and ids to reset,
+# pending_records holds containers that are classified but not written yet by id.
+# Without reset only unchanged records harvested from other file are reset to file_id.
+def _classify_records(record_containers, reset, pending_records=None, file_id=None):
     processed_record_containers_index = {}
 
     for record_container in record_containers:
-        record = record_container['record']
-        processed_record_containers_index[record.id] = record_container
+        processed_record_containers_index[record_container['id']] = record_container
+
+    existing_records = {}
+    records = Record.objects.filter(
+        id__in=processed_record_containers_index.keys()
+    ).values_list('id', 'hash', 'deleted', 'file_id')
+    for record_id, record_hash, deleted, record_file_id in records:
+        existing_records[record_id] = (record_hash, deleted, record_file_id)
+
+    if pending_records:
+        for record_id in processed_record_containers_index.keys():
+            pending_record_container = pending_records.get(record_id)
+            if pending_record_container is not None:
+                existing_records[record_id] = (pending_record_container['hash'], False, file_id)
 
     record_containers_for_create = []
     record_containers_for_update = []
-    records_for_reset = []
-    record_for_update_ids = set()
+    ids_for_reset = []
+    for record_id, record_container in processed_record_containers_index.items():
+        existing_record = existing_records.get(record_id)
+        if existing_record is None:
+            record_containers_for_create.append(record_container)
+        elif existing_record[0] != record_container['hash'] or existing_record[1]:
+            # content stage compares stored hash with json hash of record, see rehash_records
+            if not existing_record[1]:
+                record_container['stored_hash'] = existing_record[0]
+            record_containers_for_update.append(record_container)
+        elif reset or existing_record[2] != file_id:
+            ids_for_reset.append(record_id)
+
+    return record_containers_for_create, record_containers_for_update, ids_for_reset
+
+
+def _write_records(record_containers_for_create, record_containers_for_update, ids_for_reset, source, session_id,
+                   now, reset, file_id=None, record_containers_for_rehash=()):
+    create_records(record_containers_for_create, source, session_id, now, file_id=file_id)
+    update_records(record_containers_for_update, now, session_id=session_id if reset else None, file_id=file_id)
+    rehash_records(record_containers_for_rehash, session_id=session_id if reset else None, file_id=file_id)
+    reset_records(ids_for_reset, session_id if reset else None, file_id=file_id)
 
-    records = Record.objects.filter(id__in=processed_record_containers_index.keys())
 
-    for record in records:
-        record_container = processed_record_containers_index.get(record.id)
-        if record_container is not None:
-            record_for_update_ids.add(record.id)
-            precessed_record = record_container['record']
+def get_percent(current, total):
+    if total == 0:
+        return 0
+    return round(current * 100 / total)
 
-            if reset:
-                record.session_id = precessed_record.session_id
 
-            need_update = False
+def _make_record_container(record_bytes, record_tuple, offset=None):
+    record_id, original_id, record_hash, content, json_hash = record_tuple
+    return {
+        'id': record_id,
+        'original_id': original_id,
+        'hash': record_hash,
+        'content': GZipped(content) if content is not None else None,
+        'json_hash': json_hash,
+        'record_bytes': record_bytes,
+        'offset': offset,
+    }
 
-            if record.hash != precessed_record.hash or record.deleted != precessed_record.deleted:
-                need_update = True
 
-            if need_update:
-                record.hash = precessed_record.hash
-                record.update_date = precessed_record.update_date
-                record.deleted = precessed_record.deleted
-                record_containers_for_update.append({
-                    'record': record,
-                    'content': record_container['content']
-                })
-            elif reset:
-                records_for_reset.append(record)
+# yields (record bytes of batch, offsets of records, reader offset and index after batch)
+def _read_raw_batches(reader, checkpoint, batch_size):
+    records = (
+        (reader.offset, record_bytes)
+        for record_bytes in reader.read_raw(offset=checkpoint.offset, index=checkpoint.index)
+    )
+    for batch in make_batches(records, batch_size):
+        yield [record_bytes for offset, record_bytes in batch], (
+            [offset for offset, record_bytes in batch], reader.offset, reader.index)
+
+
+# record_workers.prepare_records runs in HARVESTER_WORKERS processes, None means current thread
+def _make_record_workers(preparer_args):
+    workers = get_harvest_workers()
+    if not workers:
+        return None
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=record_workers.init_worker,
+        initargs=preparer_args
+    )
+
+
+# yields (records_bytes, item, (record tuples, errors)) for (records_bytes, item) in order,
+# up to window batches are prepared in worker processes at once
+def _prepare_in_order(executor, preparer, items, window, with_content=False):
+    if executor is None:
+        for records_bytes, item in items:
+            yield records_bytes, item, preparer.prepare_records(records_bytes, with_content)
+        return
+
+    futures = collections.deque()
+    for records_bytes, item in items:
+        futures.append((records_bytes, item, executor.submit(
+            record_workers.prepare_records, records_bytes, with_content)))
+        if len(futures) >= window:
+            records_bytes, item, future = futures.popleft()
+            yield records_bytes, item, future.result()
+    while futures:
+        records_bytes, item, future = futures.popleft()
+        yield records_bytes, item, future.result()
+
+
+def _quarantine_broken_records(reader, records_bytes, offsets, errors):
+    if reader.recover and reader.quarantine is not None:
+        for position, message in errors:
+            record_bytes = bytes(records_bytes[position])
+            reader.quarantine(offsets[position], len(record_bytes), record_bytes, message)
+
+
+# builds containers of prepared records, broken records are quarantined
+def _make_record_containers(reader, records_bytes, offsets, prepared):
+    record_tuples, errors = prepared
+    _quarantine_broken_records(reader, records_bytes, offsets, errors)
+    return [
+        _make_record_container(record_bytes, record_tuple, record_offset)
+        for record_offset, record_bytes, record_tuple in zip(offsets, records_bytes, record_tuples)
+        if record_tuple is not None
+    ]
+
+
+def collect_file(source: Source, records_file: SourceRecordsFile, now, session_id, checkpoint=None):
+    batch_size = 500
+    # staging engine commits every commit_size records, batch engine commits every batch
+    commit_size = 5000
+    progress_size = 5000
+
+    if checkpoint is None:
+        checkpoint = HarvestingCheckpoint(source_file=records_file, session_id=session_id)
+
+    preparer_args = records_file.get_preparer_args()
+    encoding, extended_subfield_code = preparer_args[:2]
+
+    # records are read outside of the database thread, quarantined ranges are saved with the next commit
+    quarantined = collections.deque()
+
+    def quarantine(offset, length, bad_bytes, message):
+        print('Quarantine', length, 'bytes at offset', offset, message)
+        quarantined.append((offset, length, bad_bytes, message))
 
-    for processed_record_id in processed_record_containers_index.keys():
-        if processed_record_id not in record_for_update_ids:
-            record_containers_for_create.append(processed_record_containers_index[processed_record_id])
+    print('Start collecting source', source, 'file', records_file.file_uri)
+    print('Calculate total records...')
+    # reader only splits file into raw records, they are decoded by RecordPreparer
+    reader = Reader(
+        records_file.file_uri,
+        extended_subfield_code=extended_subfield_code,
+        encoding=encoding,
+        use_mmap=True,
+        recover=True,
+        quarantine=quarantine
+    )
+    preparer = RecordPreparer(*preparer_args)
+    # records are counted and checksum of file is calculated by the same read,
+    # incremental harvest reads only bytes after prefix checked by _prepare_file_checkpoint
+    read_length, read_records, read_checksum = checkpoint.get_read_checksum(checkpoint.offset)
+    if read_length != checkpoint.offset:
+        read_length, read_records, read_checksum = 0, 0, None
+    records, checksum, end = records_file.read_checksum(offset=read_length, checksum=read_checksum)
+    total_records = read_records + records
+    checkpoint.add_read_checksum(end, total_records, checksum)
+    checkpoint.file_checksum = checksum.hexdigest()
+    checkpoint.total_records = total_records
+    print('Total records', total_records)
 
-    create_records(record_containers_for_create)
-    update_records(record_containers_for_update)
-    reset_records(records_for_reset)
-    return len(record_containers_for_create), len(record_containers_for_update)
+    if checkpoint.offset:
+        print('Resume from offset', checkpoint.offset, 'record', checkpoint.index)
 
+    executor = _make_record_workers(preparer_args)
+    try:
+        if get_harvest_engine() == 'staging':
+            _stage_records(reader, records_file, checkpoint, preparer, executor, batch_size, commit_size, quarantined)
+            print('Merge staged records...')
+            _merge_staged_records(records_file, checkpoint, source, now, preparer)
+        else:
+            _collect_records_pipeline(
+                reader, records_file, checkpoint, source, now, preparer_args, executor, batch_size, progress_size,
+                quarantined)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    with transaction.atomic():
+        # with reset records of file that are not collected now are deleted at the end of session
+        checkpoint.file_records = _count_file_records(records_file, session_id if source.reset else None)
+        if records_file.incremental:
+            _set_file_prefix(records_file, checkpoint)
+        checkpoint.finished = True
+        checkpoint.save()
+
+    return _get_checkpoint_stats(checkpoint)
+
+
+def _save_quarantined_records(records_file, session_id, quarantined):
+    while quarantined:
+        offset, length, bad_bytes, message = quarantined.popleft()
+        QuarantinedRecord.objects.update_or_create(
+            source_file=records_file,
+            session_id=session_id,
+            offset=offset,
+            defaults={
+                'length': length,
+                'content': bad_bytes[:MAX_RECORD_LENGTH],
+                'message': message,
+            }
+        )
 
-def get_percent(current, total):
-    if total == 0:
-        return 0
-    return round(current * 100 / total)
 
+PIPELINE_QUEUE_SIZE = 4
 
-def collect_file(source: Source, records_file: SourceRecordsFile, now, session_id):
-    batch_size = 20
-    processed = 0
-    created = 0
-    updated = 0
-    deleted = 0
 
-    extended_subfield_code = ''
-    if records_file.schema == SCHEMAS['rusmarc']:
-        extended_subfield_code = '1'
+def _put_stage_item(stage_queue, item, stop):
+    while not stop.is_set():
+        try:
+            stage_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
 
-    print('Start collecting source', source, 'file', records_file.file_uri)
-    print('Calculate total records...')
-    reader = Reader(records_file.file_uri, extended_subfield_code=extended_subfield_code)
-    total_records = reader.get_total_records()
-    print('Total records', total_records)
 
-    record_containers = []
-    for rec in reader.read():
-        errors = rec.get_errors()
-        if errors:
-            print(errors)
-
-        processed += 1
-        record_json = record_to_json(rec, dump=True)
-        dump = record_json.encode('utf-8')
-        record_id, original_id, record_hash = _get_record_id(rec, dump)
-        record_containers.append({
-            'record': Record(
-                id=record_id,
+def _get_stage_item(stage_queue, stop=None):
+    while stop is None or not stop.is_set():
+        try:
+            item = stage_queue.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if isinstance(item, BaseException):
+            raise item
+        return item
+    return None
+
+
+# reads records, hashes them and extracts ids
+def _parse_stage(reader, checkpoint, preparer, executor, batch_size, parsed_queue, stop):
+    try:
+        batches = _read_raw_batches(reader, checkpoint, batch_size)
+        window = get_harvest_workers()
+        for records_bytes, (offsets, offset, index), prepared in _prepare_in_order(
+                executor, preparer, batches, window):
+            record_containers = _make_record_containers(reader, records_bytes, offsets, prepared)
+            if not _put_stage_item(parsed_queue, (record_containers, offset, index), stop):
+                return
+        _put_stage_item(parsed_queue, None, stop)
+    except Exception as e:
+        _put_stage_item(parsed_queue, e, stop)
+
+
+# yields (record bytes, (job, containers)) of containers to create and update without content
+def _iter_content_jobs(content_queue, stop):
+    while True:
+        job = _get_stage_item(content_queue, stop)
+        if job is None:
+            return
+        record_containers = [
+            record_container for record_container in job['create'] + job['update']
+            if record_container['content'] is None
+        ]
+        yield [record_container['record_bytes'] for record_container in record_containers], (job, record_containers)
+
+
+# dumps and compresses contents of records to create and update,
+# records which content can not be dumped are quarantined and not written,
+# updated records which stored hash is json hash of their content are only rehashed
+def _content_stage(preparer, executor, content_queue, written_queue, stop, quarantined):
+    try:
+        jobs = _iter_content_jobs(content_queue, stop)
+        window = get_harvest_workers()
+        for records_bytes, (job, record_containers), (record_tuples, errors) in _prepare_in_order(
+                executor, preparer, jobs, window, with_content=True):
+            for position, message in errors:
+                record_container = record_containers[position]
+                record_bytes = bytes(record_container['record_bytes'])
+                quarantined.append((record_container['offset'], len(record_bytes), record_bytes, message))
+                job['broken'].append(record_container)
+            for record_container, record_tuple in zip(record_containers, record_tuples):
+                if record_tuple is not None:
+                    record_container['content'] = GZipped(record_tuple[3])
+                    record_container['json_hash'] = record_tuple[4]
+            for record_container in job['update']:
+                if record_container['json_hash'] is not None and \
+                        record_container['json_hash'] == record_container.get('stored_hash'):
+                    record_container['content'] = None
+                    job['rehash'].append(record_container)
+            if job['broken'] or job['rehash']:
+                job['create'] = [
+                    record_container for record_container in job['create'] if record_container['content'] is not None
+                ]
+                job['update'] = [
+                    record_container for record_container in job['update'] if record_container['content'] is not None
+                ]
+            for record_container in job['create'] + job['update'] + job['rehash'] + job['broken']:
+                record_container['record_bytes'] = None
+            if not _put_stage_item(written_queue, job, stop):
+                return
+    except Exception as e:
+        _put_stage_item(written_queue, e, stop)
+
+
+# parse stage -> database thread classifies records -> content stage -> database thread writes them.
+# Stages run in threads connected by bounded queues, so reading, dumping and compressing overlap database i/o.
+# Database is used by the calling thread only, every job is committed in its own transaction,
+# progress is printed every progress_size records.
+# With record workers content stage holds up to HARVESTER_WORKERS jobs more.
+def _collect_records_pipeline(reader, records_file, checkpoint, source, now, preparer_args, executor, batch_size,
+                              progress_size, quarantined):
+    max_jobs_in_progress = PIPELINE_QUEUE_SIZE + get_harvest_workers()
+    parsed_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    content_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    written_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    stop = threading.Event()
+    threads = [
+        threading.Thread(target=_parse_stage, args=(
+            reader, checkpoint, RecordPreparer(*preparer_args), executor, batch_size, parsed_queue, stop
+        )),
+        threading.Thread(target=_content_stage, args=(
+            RecordPreparer(*preparer_args), executor, content_queue, written_queue, stop, quarantined
+        )),
+    ]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    # containers sent to content stage by id, later batches are classified against them
+    pending_records = {}
+    jobs_in_progress = 0
+    try:
+        while True:
+            while jobs_in_progress and (jobs_in_progress >= max_jobs_in_progress or not written_queue.empty()):
+                _write_records_job(
+                    _get_stage_item(written_queue), records_file, checkpoint, source, now, pending_records,
+                    progress_size, quarantined)
+                jobs_in_progress -= 1
+
+            parsed_item = _get_stage_item(parsed_queue)
+            if parsed_item is None:
+                break
+            record_containers, offset, index = parsed_item
+            record_containers_for_create, record_containers_for_update, ids_for_reset = _classify_records(
+                record_containers, source.reset, pending_records, file_id=records_file.id)
+            for record_container in record_containers_for_create + record_containers_for_update:
+                pending_records[record_container['id']] = record_container
+            content_queue.put({
+                'create': record_containers_for_create,
+                'update': record_containers_for_update,
+                'reset': ids_for_reset,
+                'rehash': [],
+                'broken': [],
+                'processed': len(record_containers),
+                'offset': offset,
+                'index': index,
+            })
+            jobs_in_progress += 1
+
+        content_queue.put(None)
+        while jobs_in_progress:
+            _write_records_job(
+                _get_stage_item(written_queue), records_file, checkpoint, source, now, pending_records, progress_size,
+                quarantined)
+            jobs_in_progress -= 1
+
+        with transaction.atomic():
+            _save_quarantined_records(records_file, checkpoint.session_id, quarantined)
+            checkpoint.offset = reader.offset
+            checkpoint.index = reader.index
+            checkpoint.save()
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+
+def _write_records_job(job, records_file, checkpoint, source, now, pending_records, progress_size, quarantined):
+    with transaction.atomic():
+        _write_records(
+            job['create'], job['update'], job['reset'], source.code, checkpoint.session_id, now, source.reset,
+            file_id=records_file.id, record_containers_for_rehash=job['rehash'])
+        _save_quarantined_records(records_file, checkpoint.session_id, quarantined)
+        checkpoint.offset = job['offset']
+        checkpoint.index = job['index']
+        checkpoint.processed += job['processed']
+        checkpoint.created += len(job['create'])
+        checkpoint.updated += len(job['update'])
+        checkpoint.save()
+
+    for record_container in job['create'] + job['update'] + job['rehash'] + job['broken']:
+        if pending_records.get(record_container['id']) is record_container:
+            del pending_records[record_container['id']]
+
+    if checkpoint.processed % progress_size < job['processed']:
+        print('processed', checkpoint.processed, get_percent(checkpoint.processed, checkpoint.total_records), '%')
+
+
+def _stage_records(reader, records_file, checkpoint, preparer, executor, batch_size, commit_size, quarantined):
+    staging_records = []
+    batches = _read_raw_batches(reader, checkpoint, batch_size)
+    for records_bytes, (offsets, offset, index), (record_tuples, errors) in _prepare_in_order(
+            executor, preparer, batches, get_harvest_workers()):
+        _quarantine_broken_records(reader, records_bytes, offsets, errors)
+        for record_offset, record_bytes, record_tuple in zip(offsets, records_bytes, record_tuples):
+            if record_tuple is None:
+                continue
+            record_id, original_id, record_hash, content, json_hash = record_tuple
+            staging_records.append(StagingRecord(
+                source_file=records_file,
+                session_id=checkpoint.session_id,
+                record_id=record_id,
                 original_id=original_id,
                 hash=record_hash,
-                source=source,
-                schema='junimarc',
-                session_id=session_id,
-                create_date=now,
-                update_date=now,
-            ),
-            'content': RecordContent(record_id=record_id, content=dump)
-        })
-
-        if len(record_containers) >= batch_size:
-            created_amount, updated_amount = process_records(record_containers, reset=source.reset)
-            created += created_amount
-            updated += updated_amount
-            record_containers = []
-
-        if processed % 100 == 0:
-            print('processed', processed, get_percent(processed, total_records), '%')
-
-    if record_containers:
-        process_records(record_containers, reset=source.reset)
+                offset=record_offset,
+                length=len(record_bytes),
+                content=content,
+            ))
+
+        # offset and index point after the batch
+        if len(staging_records) >= commit_size:
+            _save_staging_records(staging_records, checkpoint, offset, index, quarantined)
+            staging_records = []
+            print('staged', checkpoint.processed, get_percent(checkpoint.processed, checkpoint.total_records), '%')
+
+    _save_staging_records(staging_records, checkpoint, reader.offset, reader.index, quarantined)
+
+
+def _save_staging_records(staging_records, checkpoint, offset, index, quarantined):
+    with transaction.atomic():
+        StagingRecord.objects.bulk_create(staging_records, batch_size=500)
+        _save_quarantined_records(checkpoint.source_file, checkpoint.session_id, quarantined)
+        checkpoint.offset = offset
+        checkpoint.index = index
+        checkpoint.processed += len(staging_records)
+        checkpoint.save()
+
+
+def _merge_staged_records(records_file, checkpoint, source, now, preparer):
+    staging_records = StagingRecord.objects.filter(source_file=records_file, session_id=checkpoint.session_id)
+    with transaction.atomic():
+        created, updated = _merge_staging_table(
+            records_file, checkpoint.session_id, source, now, preparer, reset=source.reset)
+        broken_created, broken_updated = _write_staged_contents(
+            records_file, checkpoint, source, now, staging_records, preparer)
+        staging_records.delete()
+        checkpoint.created += created - broken_created
+        checkpoint.updated += updated - broken_updated
+        checkpoint.save()
+
+
+# marks staged updates of records which stored hash is json hash of their content, see rehash_records
+def _mark_staged_rehash(records_file, session_id, preparer):
+    staging_ids = list(StagingRecord.objects.filter(
+        source_file=records_file, session_id=session_id, action=STAGING_ACTION_UPDATE
+    ).order_by('offset').values_list('id', flat=True))
+
+    with open_file(records_file.file_uri) as fl:
+        for start in range(0, len(staging_ids), 500):
+            rows = list(StagingRecord.objects.filter(
+                id__in=staging_ids[start: start + 500]
+            ).order_by('offset').values_list('id', 'record_id', 'offset', 'length', 'content'))
+            stored_hashes = dict(Record.objects.filter(
+                id__in=[row[1] for row in rows], deleted=False
+            ).values_list('id', 'hash'))
+
+            rehash_ids = []
+            for staging_id, record_id, offset, length, content in rows:
+                stored_hash = stored_hashes.get(record_id)
+                if not stored_hash:
+                    continue
+                if content is not None:
+                    json_dump = gzip.decompress(bytes(content))
+                else:
+                    fl.seek(offset)
+                    try:
+                        json_dump = preparer.make_json_dump(fl.read(length))
+                    except ValueError:
+                        # broken record is quarantined when its content is dumped
+                        continue
+                if hashlib.md5(json_dump).hexdigest() == stored_hash:
+                    rehash_ids.append(staging_id)
+            StagingRecord.objects.filter(id__in=rehash_ids).update(action=STAGING_ACTION_REHASH)
+
+
+# creates new records, updates changed and resets session of unchanged records of staged file,
+# returns (created, updated)
+def _merge_staging_table(records_file, session_id, source, now, preparer, reset):
+    qn = connection.ops.quote_name
+
+    def columns(model, *field_names):
+        return [qn(model._meta.get_field(field_name).column) for field_name in field_names]
+
+    names = {
+        'staging': qn(StagingRecord._meta.db_table),
+        'record': qn(Record._meta.db_table),
+    }
+    for name, column in zip(
+            ('s_id', 's_source_file', 's_session_id', 's_record_id', 's_original_id', 's_hash', 's_action'),
+            columns(StagingRecord, 'id', 'source_file', 'session_id', 'record_id', 'original_id', 'hash', 'action')):
+        names[name] = column
+    for name, column in zip(
+            ('r_id', 'r_original_id', 'r_hash', 'r_source', 'r_schema', 'r_session_id', 'r_create_date',
+             'r_update_date', 'r_deleted', 'r_file_id'),
+            columns(Record, 'id', 'original_id', 'hash', 'source', 'schema', 'session_id', 'create_date',
+                    'update_date', 'deleted', 'file_id')):
+        names[name] = column
+
+    staged = '{staging}.{s_session_id} = %s AND {staging}.{s_source_file} = %s'.format(**names)
+    staged_params = [session_id, records_file.id]
+    db_now = connection.ops.adapt_datetimefield_value(now)
+
+    with connection.cursor() as cursor:
+        # the last record wins when file has records with the same id
+        cursor.execute(
+            ('DELETE FROM {staging} WHERE ' + staged + ' AND {s_id} NOT IN ('
+             'SELECT MAX({s_id}) FROM {staging} WHERE ' + staged + ' GROUP BY {s_record_id})').format(**names),
+            staged_params + staged_params
+        )
+        cursor.execute(
+            ('UPDATE {staging} SET {s_action} = %s WHERE ' + staged + ' AND NOT EXISTS ('
+             'SELECT 1 FROM {record} WHERE {record}.{r_id} = {staging}.{s_record_id})').format(**names),
+            [STAGING_ACTION_CREATE] + staged_params
+        )
+        cursor.execute(
+            ('UPDATE {staging} SET {s_action} = %s WHERE ' + staged + ' AND EXISTS ('
+             'SELECT 1 FROM {record} WHERE {record}.{r_id} = {staging}.{s_record_id} '
+             'AND ({record}.{r_hash} IS NULL OR {record}.{r_hash} <> {staging}.{s_hash} '
+             'OR {record}.{r_deleted} = %s))').format(**names),
+            [STAGING_ACTION_UPDATE] + staged_params + [True]
+        )
+        # legacy stored hashes are json hashes, contents have json codec
+        if preparer.codec == 'json':
+            _mark_staged_rehash(records_file, session_id, preparer)
+        cursor.execute(
+            ('INSERT INTO {record} ({r_id}, {r_original_id}, {r_hash}, {r_source}, {r_schema}, {r_session_id}, '
+             '{r_create_date}, {r_update_date}, {r_deleted}, {r_file_id}) '
+             'SELECT {s_record_id}, {s_original_id}, {s_hash}, %s, %s, %s, %s, %s, %s, %s FROM {staging} '
+             'WHERE ' + staged + ' AND {s_action} = %s').format(**names),
+            [source.code, 'junimarc', session_id, db_now, db_now, False, records_file.id] + staged_params +
+            [STAGING_ACTION_CREATE]
+        )
+        created = cursor.rowcount
+
+        session_update = ''
+        session_params = []
+        if reset:
+            session_update = ', {r_session_id} = %s'.format(**names)
+            session_params = [session_id]
+        cursor.execute(
+            ('UPDATE {record} SET {r_hash} = ('
+             'SELECT {staging}.{s_hash} FROM {staging} WHERE ' + staged +
+             ' AND {staging}.{s_record_id} = {record}.{r_id}), '
+             '{r_update_date} = %s, {r_deleted} = %s, {r_file_id} = %s' + session_update + ' WHERE {r_id} IN ('
+             'SELECT {staging}.{s_record_id} FROM {staging} WHERE ' + staged +
+             ' AND {staging}.{s_action} = %s)').format(**names),
+            staged_params + [db_now, False, records_file.id] + session_params + staged_params +
+            [STAGING_ACTION_UPDATE]
+        )
+        updated = cursor.rowcount
+
+        cursor.execute(
+            ('UPDATE {record} SET {r_hash} = ('
+             'SELECT {staging}.{s_hash} FROM {staging} WHERE ' + staged +
+             ' AND {staging}.{s_record_id} = {record}.{r_id}), '
+             '{r_file_id} = %s' + session_update + ' WHERE {r_id} IN ('
+             'SELECT {staging}.{s_record_id} FROM {staging} WHERE ' + staged +
+             ' AND {staging}.{s_action} = %s)').format(**names),
+            staged_params + [records_file.id] + session_params + staged_params + [STAGING_ACTION_REHASH]
+        )
 
-    if source.reset:
-        deleted = Record.objects.filter(
-            deleted=False
-        ).exclude(
-            session_id=session_id
-        ).update(
-            deleted=True,
-            update_date=now
+        # unchanged records, without reset only ones harvested from other file
+        unchanged_filter = ''
+        unchanged_params = []
+        if not reset:
+            unchanged_filter = ' AND ({r_file_id} IS NULL OR {r_file_id} <> %s)'.format(**names)
+            unchanged_params = [records_file.id]
+        cursor.execute(
+            ('UPDATE {record} SET {r_file_id} = %s' + session_update + ' WHERE {r_id} IN ('
+             'SELECT {staging}.{s_record_id} FROM {staging} WHERE ' + staged +
+             ' AND {staging}.{s_action} IS NULL)' + unchanged_filter).format(**names),
+            [records_file.id] + session_params + staged_params + unchanged_params
         )
 
+    return created, updated
+
+
+# dumps contents of created and updated staged records, records are read from file in offset order,
+# staged contents are compressed already.
+# Records which content can not be dumped are quarantined like broken records of batch engine: created ones
+# are deleted, updated ones keep old content with empty hash, so they are dumped again by the next harvest
+# (Oracle stores empty string as NULL, so merge compares hashes NULL-safe),
+# with reset they are not collected in session and are deleted. Returns (broken created, broken updated)
+def _write_staged_contents(records_file, checkpoint, source, now, staging_records, preparer):
+    staging_ids = list(staging_records.filter(
+        action__in=(STAGING_ACTION_CREATE, STAGING_ACTION_UPDATE)
+    ).order_by('offset').values_list('id', flat=True))
+
+    broken_created_ids = []
+    broken_updated_ids = []
+    with open_file(records_file.file_uri) as fl:
+        for start in range(0, len(staging_ids), 500):
+            rows = StagingRecord.objects.filter(
+                id__in=staging_ids[start: start + 500]
+            ).order_by('offset').values_list('record_id', 'offset', 'length', 'action', 'content')
+
+            record_contents = []
+            updated_ids = []
+            for record_id, offset, length, action, content in rows:
+                if content is None:
+                    fl.seek(offset)
+                    record_bytes = fl.read(length)
+                    record_tuple = preparer.prepare_record(record_bytes, with_content=True)
+                    if record_tuple is None:
+                        QuarantinedRecord.objects.update_or_create(
+                            source_file=records_file,
+                            session_id=checkpoint.session_id,
+                            offset=offset,
+                            defaults={
+                                'length': length,
+                                'content': record_bytes,
+                                'message': preparer.last_error,
+                            }
+                        )
+                        if action == STAGING_ACTION_UPDATE:
+                            broken_updated_ids.append(record_id)
+                        else:
+                            broken_created_ids.append(record_id)
+                        continue
+                    content = record_tuple[3]
+                if action == STAGING_ACTION_UPDATE:
+                    updated_ids.append(record_id)
+                record_contents.append(RecordContent(record_id=record_id, content=GZipped(content)))
+
+            RecordContent.objects.filter(record_id__in=updated_ids).delete()
+            RecordContent.objects.bulk_create(record_contents)
+
+    for start in range(0, len(broken_created_ids), 500):
+        Record.objects.filter(id__in=broken_created_ids[start: start + 500]).delete()
+    for start in range(0, len(broken_updated_ids), 500):
+        broken_updated_records = Record.objects.filter(id__in=broken_updated_ids[start: start + 500])
+        if source.reset:
+            broken_updated_records.update(hash='', deleted=True, update_date=now)
+        else:
+            broken_updated_records.update(hash='')
+    return len(broken_created_ids), len(broken_updated_ids)
+
+
+def _get_checkpoint_stats(checkpoint):
     return {
-        'processed': processed,
-        'created': created,
-        'updated': updated,
-        'deleted': deleted,
-        'total_records': total_records,
+        'processed': checkpoint.processed,
+        'created': checkpoint.created,
+        'updated': checkpoint.updated,
+        'deleted': checkpoint.deleted,
+        'total_records': checkpoint.total_records,
     }
 
 
+def _get_session_id(source: Source):
+    last_checkpoint = HarvestingCheckpoint.objects.filter(
+        source_file__source=source
+    ).order_by('-session_id').first()
+
+    if last_checkpoint is None:
+        return int(time.time())
+
+    if not HarvestingStatus.objects.filter(source=source, session_id=last_checkpoint.session_id).exists():
+        print('Resume session', last_checkpoint.session_id)
+        return last_checkpoint.session_id
+
+    return max(int(time.time()), last_checkpoint.session_id + 1)
+
+
+def _count_file_records(source_file: SourceRecordsFile, session_id=None):
+    records = Record.objects.filter(file_id=source_file.id, deleted=False)
+    if session_id is not None:
+        records = records.filter(session_id=session_id)
+    return records.count()
+
+
+# prefix ends after the last read record, bytes quarantined at the end of file may be a record being appended.
+# Its checksum continues checksum of bytes read before
+def _set_file_prefix(records_file, checkpoint):
+    prefix_length = checkpoint.offset
+    last_quarantined_record = QuarantinedRecord.objects.filter(
+        source_file=records_file,
+        session_id=checkpoint.session_id
+    ).order_by('-offset').first()
+    if last_quarantined_record is not None and \
+            last_quarantined_record.offset + last_quarantined_record.length == prefix_length:
+        prefix_length = last_quarantined_record.offset
+    checkpoint.prefix_length = prefix_length
+    read_length, read_records, prefix_checksum = checkpoint.get_read_checksum(prefix_length)
+    if read_length < prefix_length or prefix_checksum is None:
+        prefix_checksum = records_file.read_checksum(
+            offset=read_length, length=prefix_length - read_length, checksum=prefix_checksum)[1]
+    checkpoint.prefix_checksum = prefix_checksum.hexdigest() if prefix_checksum is not None else ''
+
+
+# size, mtime and checksum of file are stored on checkpoint, file is not harvested when they match ones
+# of the last finished harvest of file and its records are moved to the current session instead.
+# File is read for checksum only when its size and mtime are not changed, checksum of harvested file
+# is calculated while its records are counted.
+# Incremental file with the same records before prefix of the last harvest is collected from there.
+# File is harvested again when any of its records was taken by other file with the same record id.
+def _prepare_file_checkpoint(source: Source, source_file: SourceRecordsFile, checkpoint):
+    checkpoint.file_size, checkpoint.file_mtime = source_file.get_stat()
+    last_checkpoint = HarvestingCheckpoint.objects.filter(
+        source_file=source_file,
+        finished=True,
+        session_id__lt=checkpoint.session_id
+    ).order_by('-session_id').first()
+
+    if last_checkpoint is not None and last_checkpoint.file_checksum and (
+            last_checkpoint.file_size, last_checkpoint.file_mtime) == (checkpoint.file_size, checkpoint.file_mtime):
+        checkpoint.file_checksum = source_file.get_records_checksum()[1]
+
+    prefix_checksum = ''
+    if source_file.incremental and last_checkpoint is not None and last_checkpoint.prefix_checksum and not (
+            checkpoint.file_checksum and checkpoint.file_checksum == last_checkpoint.file_checksum):
+        prefix_records, prefix_md5, prefix_end = source_file.read_checksum(length=last_checkpoint.prefix_length)
+        if prefix_md5 is not None:
+            prefix_checksum = prefix_md5.hexdigest()
+            checkpoint.add_read_checksum(prefix_end, prefix_records, prefix_md5)
+
+    with transaction.atomic():
+        if last_checkpoint is not None and last_checkpoint.file_records == _count_file_records(source_file):
+            if checkpoint.file_checksum and checkpoint.file_checksum == last_checkpoint.file_checksum:
+                print('File', source_file.file_uri, 'not changed since session', last_checkpoint.session_id)
+                _carry_file_records(source, source_file, checkpoint, last_checkpoint)
+                checkpoint.offset = last_checkpoint.offset
+                checkpoint.total_records = last_checkpoint.total_records
+                checkpoint.finished = True
+            elif source_file.incremental and last_checkpoint.prefix_checksum and \
+                    prefix_checksum == last_checkpoint.prefix_checksum:
+                print('File', source_file.file_uri, 'appended since session', last_checkpoint.session_id)
+                _carry_file_records(source, source_file, checkpoint, last_checkpoint)
+                checkpoint.offset = last_checkpoint.prefix_length
+                # bytes quarantined after prefix took one record position
+                if last_checkpoint.prefix_length < last_checkpoint.offset:
+                    checkpoint.index -= 1
+            elif source_file.incremental:
+                print('File', source_file.file_uri, 'changed before offset', last_checkpoint.prefix_length,
+                      'collect whole file')
+        checkpoint.save()
+
+
+# file changed after checkpoint of session was saved, it is collected again from the beginning.
+# Records, staged and quarantined records of the old file are not kept by session.
+def _restart_file_checkpoint(source: Source, source_file: SourceRecordsFile, checkpoint):
+    last_checkpoint = HarvestingCheckpoint.objects.filter(
+        source_file=source_file,
+        finished=True,
+        session_id__lt=checkpoint.session_id
+    ).order_by('-session_id').first()
+
+    with transaction.atomic():
+        if source.reset:
+            # records which are not in the new file are deleted at the end of session
+            Record.objects.filter(
+                file_id=source_file.id,
+                session_id=checkpoint.session_id
+            ).update(
+                session_id=last_checkpoint.session_id if last_checkpoint is not None else 0
+            )
+        StagingRecord.objects.filter(source_file=source_file, session_id=checkpoint.session_id).delete()
+        QuarantinedRecord.objects.filter(source_file=source_file, session_id=checkpoint.session_id).delete()
+        checkpoint.offset = 0
+        checkpoint.index = 0
+        checkpoint.processed = 0
+        checkpoint.created = 0
+        checkpoint.updated = 0
+        checkpoint.deleted = 0
+        checkpoint.file_records = None
+        checkpoint.prefix_length = None
+        checkpoint.prefix_checksum = ''
+        checkpoint.save()
+
+
+def _carry_file_records(source: Source, source_file: SourceRecordsFile, checkpoint, last_checkpoint):
+    if source.reset:
+        Record.objects.filter(
+            file_id=source_file.id,
+            deleted=False
+        ).update(
+            session_id=checkpoint.session_id
+        )
+    checkpoint.index = last_checkpoint.index
+    checkpoint.processed = last_checkpoint.processed
+    checkpoint.file_records = last_checkpoint.file_records
+    checkpoint.prefix_length = last_checkpoint.prefix_length
+    checkpoint.prefix_checksum = last_checkpoint.prefix_checksum
+
+
+# records of source that are not collected in session by any of its files,
+# uses (source, deleted, session_id) index of Record
+def _delete_uncollected_records(source: Source, session_id, now):
+    return Record.objects.filter(
+        source=source.code,
+        deleted=False
+    ).exclude(
+        session_id=session_id
+    ).update(
+        deleted=True,
+        update_date=now
+    )
+
+
 def collect_source(source: Source):
     now = timezone.now()
-    session_id = int(time.time())
+    session_id = _get_session_id(source)
 
     created = 0
     updated = 0
@@ -360,14 +1288,34 @@ def collect_source(source: Source):
     processed = 0
     total_records = 0
 
+    checkpoints = []
     for source_file in SourceRecordsFile.objects.filter(source=source):
-        stats = collect_file(source, source_file, session_id=session_id, now=now)
+        checkpoint, checkpoint_created = HarvestingCheckpoint.objects.get_or_create(
+            source_file=source_file,
+            session_id=session_id
+        )
+        if not checkpoint.finished and checkpoint.offset and not checkpoint.is_file_unchanged():
+            print('File', source_file.file_uri, 'changed since session', session_id, 'started, collect it again')
+            _restart_file_checkpoint(source, source_file, checkpoint)
+        # unchanged and appended files are found before others are harvested and take their records
+        if not checkpoint.finished and not checkpoint.offset:
+            _prepare_file_checkpoint(source, source_file, checkpoint)
+        checkpoints.append((source_file, checkpoint))
+
+    for source_file, checkpoint in checkpoints:
+        if checkpoint.finished:
+            print('File', source_file.file_uri, 'already collected in session', session_id)
+            stats = _get_checkpoint_stats(checkpoint)
+        else:
+            stats = collect_file(source, source_file, session_id=session_id, now=now, checkpoint=checkpoint)
         created += stats['created']
         updated += stats['updated']
-        deleted += stats['deleted']
         processed += stats['processed']
         total_records += stats['total_records']
 
+    if source.reset:
+        deleted = _delete_uncollected_records(source, session_id, now)
+
     HarvestingStatus(
         source=source,
         create_date=now,
@@ -388,7 +1336,29 @@ def collect_source(source: Source):
     print('for delete', deleted)
 
 
-@transaction.atomic()
-def collect():
-    for source in Source.objects.filter(active=True):
+# error of source is saved as its HarvestingStatus, session is resumed on the next collect
+def _collect_source_isolated(source: Source):
+    try:
         collect_source(source)
+        return True
+    except Exception as e:
+        print('Source', source, 'failed')
+        traceback.print_exc()
+        HarvestingStatus(
+            source=source,
+            create_date=timezone.now(),
+            error=True,
+            message='%s: %s' % (type(e).__name__, e),
+        ).save()
+        return False
+    finally:
+        # every thread has its own connection
+        connection.close()
+
+
+# sources are collected in HARVESTER_SOURCES_CONCURRENCY threads, each source commits its own transactions
+def collect():
+    sources = list(Source.objects.filter(active=True))
+    with ThreadPoolExecutor(max_workers=get_harvest_sources_concurrency()) as executor:
+        results = list(executor.map(_collect_source_isolated, sources))
+    print('collected sources', results.count(True), 'failed', results.count(False))
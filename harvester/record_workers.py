@@ -0,0 +1,149 @@
+# encode: utf-8
+# Per record cpu work of harvest: decoding ids, hashing, dumping and compressing contents.
+# Functions of this module run in worker processes, so it must not import django.
+import gzip
+import hashlib
+import json
+
+from junimarc.binary.junimarc import record_to_binary
+from junimarc.iso2709.reader import Reader
+from junimarc.json.junimarc import record_to_json
+
+CONTENT_COMPRESS_LEVEL = 7
+
+
+def _dump_json_record(jrecord):
+    return record_to_json(jrecord, dump=True).encode('utf-8')
+
+
+RECORD_CODECS = {
+    'json': _dump_json_record,
+    'binary': record_to_binary,
+}
+
+
+def compress_content(content):
+    return gzip.compress(content, compresslevel=CONTENT_COMPRESS_LEVEL)
+
+
+class BrokenRecordError(ValueError):
+    pass
+
+
+# decoding options and codec, contents made with other ones differ
+def get_hash_prefix(encoding, extended_subfield_code, codec):
+    return ('%s:%s:%s:' % (codec, encoding, extended_subfield_code)).encode('utf-8')
+
+
+class RecordPreparer(object):
+    def __init__(self, encoding, extended_subfield_code, codec):
+        self.codec = codec
+        self.encoding = encoding
+        # Record.hash is md5 of raw record bytes, so unchanged records are detected before their content is dumped.
+        # hash_prefix holds decoding options and codec, content is dumped again when any of them changes.
+        self.hash_prefix = get_hash_prefix(encoding, extended_subfield_code, codec)
+        self.reader = Reader(None, extended_subfield_code=extended_subfield_code, encoding=encoding)
+        self.last_error = ''
+
+    # errors of subfields which reader skips while decoding, they do not make record broken
+    def report_errors(self):
+        if self.reader.errors:
+            print(self.reader.errors)
+            self.reader.errors = []
+
+    def make_json_dump(self, record_bytes):
+        self.reader.errors = []
+        record_json = self.reader.decode_record_to_json(record_bytes)
+        if record_json is None:
+            raise BrokenRecordError(self.reader.last_error)
+        return json.dumps(record_json, ensure_ascii=False).encode('utf-8')
+
+    def make_content(self, record_bytes):
+        if self.codec == 'json':
+            content = self.make_json_dump(record_bytes)
+        else:
+            self.reader.errors = []
+            rec = self.reader.decode_record(record_bytes)
+            if rec is None:
+                raise BrokenRecordError(self.reader.last_error)
+            content = RECORD_CODECS[self.codec](rec)
+        self.report_errors()
+        return content
+
+    # checks the whole directory, tags and encoding of record, so its content can be dumped later,
+    # returns data of the first not empty 001
+    def get_original_id(self, record_bytes):
+        parsed_record = self.reader.parse_record(record_bytes)
+        if parsed_record is None:
+            raise BrokenRecordError(self.reader.last_error)
+        leader, field_entries = parsed_record
+
+        # fields are decoded from slices of record between ascii delimiters
+        str(record_bytes, self.encoding)
+        original_id = ''
+        for tag, field_start, field_end in field_entries:
+            int(tag)
+            if not original_id and tag == '001':
+                original_id = str(record_bytes[field_start: field_end], self.encoding)
+        return original_id
+
+    # returns (id, original_id, hash, compressed content, json hash) or None if record is broken,
+    # content is compressed when with_content or when json content is dumped for id of record without 001,
+    # else it is None.
+    # json hash is md5 of json content, Record.hash of records harvested before hashes of raw bytes,
+    # it is None unless json content is dumped
+    def prepare_record(self, record_bytes, with_content=False):
+        try:
+            original_id = self.get_original_id(record_bytes)
+            content = None
+            if original_id:
+                record_id = hashlib.md5(original_id.encode('utf-8')).hexdigest()
+                if with_content:
+                    content = self.make_content(record_bytes)
+            else:
+                # records without 001 are identified by json dump whatever codec is, so codec does not change ids
+                json_dump = self.make_json_dump(record_bytes)
+                record_id = hashlib.md5(json_dump).hexdigest()
+                if self.codec == 'json':
+                    content = json_dump
+                    self.report_errors()
+                elif with_content:
+                    content = self.make_content(record_bytes)
+        except ValueError as e:
+            self.last_error = str(e)
+            return None
+
+        record_hash_md5 = hashlib.md5(self.hash_prefix)
+        record_hash_md5.update(record_bytes)
+
+        json_hash = None
+        if content is not None:
+            if self.codec == 'json':
+                json_hash = hashlib.md5(content).hexdigest()
+            content = compress_content(content)
+        return record_id, original_id, record_hash_md5.hexdigest(), content, json_hash
+
+    # returns (record tuples, errors), errors is list of (position, message) of broken records,
+    # their record tuples are None
+    def prepare_records(self, records_bytes, with_content=False):
+        record_tuples = []
+        errors = []
+        for record_bytes in records_bytes:
+            record_tuple = self.prepare_record(record_bytes, with_content)
+            if record_tuple is None:
+                errors.append((len(record_tuples), self.last_error))
+            record_tuples.append(record_tuple)
+        return record_tuples, errors
+
+
+# preparer of worker process, set by init_worker
+_preparer = None
+
+
+def init_worker(encoding, extended_subfield_code, codec):
+    global _preparer
+    _preparer = RecordPreparer(encoding, extended_subfield_code, codec)
+
+
+def prepare_records(records_bytes, with_content=False):
+    return _preparer.prepare_records(records_bytes, with_content)
@@ -1,6 +1,302 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-from django.test import TestCase
+import contextlib
+import datetime
+import gzip
+import hashlib
+import io
+import itertools
+import os
+import shutil
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from junimarc.binary.junimarc import is_binary
+
+from . import models
+from .record_workers import RecordPreparer
+from .models import HarvestingCheckpoint, HarvestingStatus, QuarantinedRecord, Record, RecordContent, Source, \
+    SourceRecordsFile, StagingRecord, collect_source, load_record
+
+FIELD_TERMINATOR = b'\x1e'
+RECORD_TERMINATOR = b'\x1d'
+SUBFIELD_DELIMITER = '\x1f'
+
+# staging engine commits every 5000 records, crash after the first commit leaves file half collected
+CRASH_RECORDS = 6000
+
+
+# iso2709 record with 001 and title in 200a, without 001 when original_id is None
+def make_record(original_id, title):
+    fields = [('200', '1 ' + SUBFIELD_DELIMITER + 'a' + title)]
+    if original_id is not None:
+        fields.insert(0, ('001', original_id))
+    directory = b''
+    data = b''
+    for tag, field_data in fields:
+        field_bytes = field_data.encode('utf-8') + FIELD_TERMINATOR
+        directory += tag.encode('ascii') + b'%04d%05d' % (len(field_bytes), len(data))
+        data += field_bytes
+    base_address = 24 + len(directory) + 1
+    leader = b'%05dnam  22%05d   450 ' % (base_address + len(data) + 1, base_address)
+    return leader + directory + FIELD_TERMINATOR + data + RECORD_TERMINATOR
+
+
+def make_records(count, prefix='id', title='title'):
+    return [make_record('%s%s' % (prefix, i), '%s %s' % (title, i)) for i in range(count)]
+
+
+class HarvestCrash(Exception):
+    pass
+
+
+class CollectSourceTestsMixin(object):
+    engine = None
+    # function which crashes harvest in the middle of file on crash_calls + 1 call
+    crash_target = None
+    crash_calls = 1
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.source = Source.objects.create(code='test', name='test', reset=True)
+        self.records_file = SourceRecordsFile.objects.create(
+            source=self.source,
+            file_uri=os.path.join(self.directory, 'records.iso')
+        )
+
+    def write_records(self, records):
+        with open(self.records_file.file_uri, 'wb') as fl:
+            fl.write(b''.join(records))
+
+    def collect(self, **settings):
+        with override_settings(HARVESTER_ENGINE=self.engine, **settings), contextlib.redirect_stdout(io.StringIO()):
+            collect_source(self.source)
+        return HarvestingStatus.objects.filter(source=self.source).latest('id')
+
+    def crash(self):
+        original = getattr(models, self.crash_target)
+        calls = itertools.count(1)
+
+        def crashing(*args, **kwargs):
+            if next(calls) > self.crash_calls:
+                raise HarvestCrash()
+            return original(*args, **kwargs)
+
+        with mock.patch.object(models, self.crash_target, crashing):
+            with self.assertRaises(HarvestCrash):
+                self.collect()
+        return HarvestingCheckpoint.objects.get(source_file=self.records_file)
+
+    def get_live_ids(self):
+        return set(Record.objects.filter(source=self.source.code, deleted=False).values_list('original_id', flat=True))
+
+    def get_title(self, original_id):
+        record_content = RecordContent.objects.get(record__original_id=original_id)
+        return load_record(record_content.content).get_fields('200')[0].get_subfields('a')[0].get_data()
+
+    def test_create_records(self):
+        self.write_records(make_records(3))
+        status = self.collect()
+
+        self.assertEqual((status.created, status.updated, status.deleted, status.processed), (3, 0, 0, 3))
+        self.assertEqual(self.get_live_ids(), {'id0', 'id1', 'id2'})
+        self.assertEqual(RecordContent.objects.count(), 3)
+        self.assertEqual(self.get_title('id1'), 'title 1')
+        self.assertFalse(StagingRecord.objects.exists())
+
+    def test_rerun_unchanged_file(self):
+        self.write_records(make_records(3))
+        self.collect()
+        status = self.collect()
+
+        self.assertEqual((status.created, status.updated, status.deleted, status.processed), (0, 0, 0, 3))
+        self.assertEqual(
+            Record.objects.filter(session_id=status.session_id, deleted=False).count(), 3)
+
+    def test_update_changed_records(self):
+        self.write_records(make_records(3))
+        self.collect()
+        records = make_records(3)
+        records[1] = make_record('id1', 'changed title')
+        self.write_records(records)
+        status = self.collect()
+
+        self.assertEqual((status.created, status.updated, status.deleted), (0, 1, 0))
+        self.assertEqual(self.get_title('id1'), 'changed title')
+        self.assertEqual(self.get_title('id2'), 'title 2')
+
+    def test_undelete_records(self):
+        self.write_records(make_records(3))
+        self.collect()
+        Record.objects.filter(original_id='id1').update(deleted=True)
+        status = self.collect()
+
+        self.assertEqual((status.created, status.updated, status.deleted), (0, 1, 0))
+        self.assertEqual(self.get_live_ids(), {'id0', 'id1', 'id2'})
+
+    def test_delete_uncollected_records(self):
+        self.write_records(make_records(3))
+        self.collect()
+        self.write_records(make_records(2))
+        status = self.collect()
+
+        self.assertEqual((status.created, status.updated, status.deleted), (0, 0, 1))
+        self.assertEqual(self.get_live_ids(), {'id0', 'id1'})
+
+    def test_record_codec_does_not_change_ids(self):
+        self.source.reset = False
+        self.source.save()
+        records = [make_record(None, 'title %s' % i) for i in range(3)]
+        self.write_records(records)
+        self.collect()
+        ids = set(Record.objects.values_list('id', flat=True))
+
+        # not changed file is harvested again with other codec
+        self.collect(HARVESTER_RECORD_CODEC='binary')
+        self.assertEqual(set(Record.objects.filter(deleted=False).values_list('id', flat=True)), ids)
+        for content in RecordContent.objects.values_list('content', flat=True):
+            self.assertTrue(is_binary(gzip.decompress(bytes(content))))
+
+    def test_legacy_json_hash_is_only_rewritten(self):
+        records = make_records(3)
+        self.write_records(records)
+        self.collect()
+        hashes = dict(Record.objects.values_list('id', 'hash'))
+        contents = dict(RecordContent.objects.values_list('record_id', 'content'))
+        update_date = timezone.now() - datetime.timedelta(days=1)
+        for record_id, content in contents.items():
+            Record.objects.filter(id=record_id).update(
+                hash=hashlib.md5(gzip.decompress(bytes(content))).hexdigest(), update_date=update_date)
+
+        self.write_records(records[::-1])
+        status = self.collect()
+        self.assertEqual((status.created, status.updated, status.deleted, status.processed), (0, 0, 0, 3))
+        self.assertEqual(dict(Record.objects.values_list('id', 'hash')), hashes)
+        self.assertEqual(set(Record.objects.values_list('update_date', flat=True)), {update_date})
+        self.assertEqual(dict(RecordContent.objects.values_list('record_id', 'content')), contents)
+
+    def test_incremental_file_is_read_after_prefix(self):
+        self.records_file.incremental = True
+        self.records_file.save()
+        records = make_records(5)
+        self.write_records(records[:3])
+        self.collect()
+        self.write_records(records)
+
+        original = SourceRecordsFile.read_checksum
+        reads = []
+
+        def read_checksum(records_file, offset=0, length=None, checksum=None):
+            reads.append((offset, length))
+            return original(records_file, offset, length, checksum)
+
+        with mock.patch.object(SourceRecordsFile, 'read_checksum', read_checksum):
+            status = self.collect()
+        prefix_length = len(b''.join(records[:3]))
+        self.assertEqual(reads, [(0, prefix_length), (prefix_length, None)])
+
+        self.assertEqual((status.created, status.processed, status.total_records), (2, 5, 5))
+        checkpoint = HarvestingCheckpoint.objects.get(source_file=self.records_file, session_id=status.session_id)
+        self.assertEqual(checkpoint.file_checksum, self.records_file.get_records_checksum()[1])
+        self.assertEqual(checkpoint.prefix_checksum, checkpoint.file_checksum)
+
+    def test_resume_after_crash(self):
+        self.write_records(make_records(CRASH_RECORDS))
+        checkpoint = self.crash()
+        self.assertFalse(checkpoint.finished)
+        self.assertGreater(checkpoint.offset, 0)
+        self.assertLess(checkpoint.processed, CRASH_RECORDS)
+
+        status = self.collect()
+        self.assertEqual(status.session_id, checkpoint.session_id)
+        self.assertEqual(status.processed, CRASH_RECORDS)
+        self.assertEqual(len(self.get_live_ids()), CRASH_RECORDS)
+        self.assertEqual(RecordContent.objects.count(), CRASH_RECORDS)
+        self.assertFalse(StagingRecord.objects.exists())
+
+    def test_collect_file_changed_after_crash_again(self):
+        self.write_records(make_records(CRASH_RECORDS))
+        self.crash()
+        self.write_records(make_records(CRASH_RECORDS, prefix='new'))
+
+        status = self.collect()
+        self.assertEqual(status.processed, CRASH_RECORDS)
+        self.assertEqual(self.get_live_ids(), {'new%s' % i for i in range(CRASH_RECORDS)})
+        self.assertFalse(QuarantinedRecord.objects.exists())
+        self.assertFalse(StagingRecord.objects.exists())
+
+    def write_broken_records(self):
+        records = make_records(5)
+        # not numeric length of 200 in directory
+        records[1] = records[1][:24 + 12 + 3] + b'xx' + records[1][24 + 12 + 5:]
+        # not utf-8 bytes in title
+        records[3] = make_record('id3', 'bad').replace(b'bad', b'\xff\xff\xff')
+        self.write_records([b'garbage' + RECORD_TERMINATOR] + records)
+        return records
+
+    def assert_broken_records_quarantined(self, records):
+        offsets = [len(b'garbage' + RECORD_TERMINATOR)]
+        for record in records:
+            offsets.append(offsets[-1] + len(record))
+        self.assertEqual(
+            list(QuarantinedRecord.objects.order_by('offset').values_list('offset', 'length')),
+            [(0, 8), (offsets[1], len(records[1])), (offsets[3], len(records[3]))]
+        )
+        self.assertEqual(self.get_live_ids(), {'id0', 'id2', 'id4'})
+        self.assertEqual(RecordContent.objects.count(), 3)
+
+    def test_quarantine_broken_records(self):
+        records = self.write_broken_records()
+        with self.assertLogs('junimarc.iso2709.reader', 'ERROR'):
+            status = self.collect()
+
+        self.assertEqual(status.processed, 3)
+        self.assert_broken_records_quarantined(records)
+
+    def test_quarantine_broken_records_with_record_workers(self):
+        records = self.write_broken_records()
+        with self.assertLogs('junimarc.iso2709.reader', 'ERROR'):
+            self.collect(HARVESTER_WORKERS=2)
+
+        self.assert_broken_records_quarantined(records)
+
+
+class BatchEngineTests(CollectSourceTestsMixin, TestCase):
+    engine = 'batch'
+    crash_target = '_write_records'
+
+
+class StagingEngineTests(CollectSourceTestsMixin, TestCase):
+    engine = 'staging'
+    crash_target = '_save_staging_records'
+
+
+class RecordPreparerTests(TestCase):
+    def test_decoding_errors_are_reported_per_record(self):
+        # extended subfield with not numeric tag is skipped with error
+        record = make_record('id0', 'title' + SUBFIELD_DELIMITER + '1ab9 1')
+        for codec in ('json', 'binary'):
+            preparer = RecordPreparer('utf-8', '1', codec)
+            output = io.StringIO()
+            with self.assertLogs('junimarc.iso2709.reader', 'ERROR'), contextlib.redirect_stdout(output):
+                for i in range(3):
+                    self.assertIsNotNone(preparer.prepare_record(record, with_content=True))
+            self.assertEqual(preparer.reader.errors, [])
+            self.assertEqual(output.getvalue().count('ab9'), 3)
+
+
+class HarvestSettingsTests(TestCase):
+    @override_settings(HARVESTER_ENGINE='stagin')
+    def test_unknown_engine(self):
+        with self.assertRaises(ImproperlyConfigured):
+            models.get_harvest_engine()
+
+    @override_settings(HARVESTER_RECORD_CODEC='jsn')
+    def test_unknown_record_codec(self):
+        with self.assertRaises(ImproperlyConfigured):
+            models.get_record_codec()
@@ -153,7 +153,6 @@ def records(request, source_id):
 
 
 @login_required
-@atomic
 def collect_source(request, source_id):
     source = get_object_or_404(models.Source, id=source_id)
     models.collect_source(source)
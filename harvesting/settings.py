@@ -85,6 +85,21 @@ DATABASES = {
     }
 }
 
+# Codec of harvested record contents: 'json' or 'binary' (junimarc.binary),
+# contents of both codecs are readable whatever codec is set
+HARVESTER_RECORD_CODEC = 'json'
+
+# Harvest engine: 'batch' reconciles records batch by batch,
+# 'staging' loads whole file into staging table and merges it with set-based sql
+HARVESTER_ENGINE = 'batch'
+
+# Worker processes for decoding, hashing, dumping and compressing records, 0 runs them in harvest process
+HARVESTER_WORKERS = 0
+
+# Sources collected at the same time by collect, every source starts its own HARVESTER_WORKERS.
+# Sources collected together should not share record ids
+HARVESTER_SOURCES_CONCURRENCY = 1
+
 # Password validation
 # https://docs.djangoproject.com/en/1.11/ref/settings/#auth-password-validators
 
@@ -0,0 +1,143 @@
+# encoding: utf-8
+# Compares iso2709 Reader decoding with previous byte by byte decoder.
+# Usage: python -m junimarc.benchmark path/to/records.iso [extended_subfield_code] [encoding]
+import sys
+import time
+
+from junimarc import record
+from junimarc.iso2709 import constants
+from junimarc.iso2709.reader import Reader
+from junimarc.json.junimarc import record_to_json
+
+ROUNDS = 3
+
+
+class LegacyReader(Reader):
+    def decode_record(self, record_bytes):
+        record_bytes = bytearray(record_bytes)
+        record_bytes_length = len(record_bytes)
+        if record_bytes_length < constants.LEADER_LENGTH:
+            self._log_error('record bytes length less then leader length')
+            return None
+
+        try:
+            record_length = int(record_bytes[0:5])
+        except ValueError as e:
+            self._log_error(e)
+            return None
+
+        if record_bytes_length < record_length:
+            self._log_error('record bytes length less then declared record length')
+            return None
+
+        try:
+            base_address = int(record_bytes[12:17])
+        except ValueError as e:
+            self._log_error(e)
+            return None
+
+        leader = record_bytes[0: constants.LEADER_LENGTH]
+        offset = constants.LEADER_LENGTH
+
+        fields = []
+        while offset < base_address - 1:
+            tag = record_bytes[offset: offset + 3]
+            offset += 3
+            field_length = int(record_bytes[offset: offset + 4])
+            offset += 4
+            field_starting_position = int(record_bytes[offset: offset + 5])
+            offset += 5
+            field_offset = base_address + field_starting_position
+            fields.append(
+                self.decode_field(
+                    tag.decode(self.encoding),
+                    record_bytes[field_offset: field_offset + field_length - 1]
+                )
+            )
+
+        return record.Record(leader=leader.decode(self.encoding), fields=fields)
+
+    def decode_data_field(self, tag, field_bytes):
+        field_length = len(field_bytes)
+        if field_length > 0:
+            ind1 = chr(field_bytes[0])
+        else:
+            ind1 = u' '
+
+        if field_length > 1:
+            ind2 = chr(field_bytes[1])
+        else:
+            ind2 = u' '
+
+        subfields = []
+        field = record.DataField(tag=tag, ind1=ind1, ind2=ind2, subfields=subfields)
+
+        if field_length > 3:
+            start_of_subfield_index = 3
+            end_of_subfield_index = start_of_subfield_index
+            while end_of_subfield_index < field_length:
+                if field_bytes[end_of_subfield_index] == constants.SUBFIELD_DELIMITER:
+                    subfields.append(
+                        self.decode_data_subfield(field_bytes[start_of_subfield_index: end_of_subfield_index]))
+                    end_of_subfield_index += 1
+                    start_of_subfield_index = end_of_subfield_index
+                else:
+                    end_of_subfield_index += 1
+            if start_of_subfield_index != end_of_subfield_index:
+                subfields.append(self.decode_data_subfield(field_bytes[start_of_subfield_index: end_of_subfield_index]))
+
+        if self.extended_subfield_code and field.get_subfields(self.extended_subfield_code):
+            self.decode_extended_subfield(field)
+        return field
+
+
+def read_records_bytes(path):
+    records_bytes = []
+    with open(path, 'rb') as fl:
+        data = fl.read()
+    offset = 0
+    while offset < len(data):
+        record_length = int(data[offset: offset + 5])
+        records_bytes.append(data[offset: offset + record_length])
+        offset += record_length
+    return records_bytes
+
+
+def measure(reader, records_bytes):
+    best_time = None
+    for i in range(ROUNDS):
+        start = time.perf_counter()
+        for record_bytes in records_bytes:
+            reader.decode_record(record_bytes)
+        spent = time.perf_counter() - start
+        if best_time is None or spent < best_time:
+            best_time = spent
+    return best_time
+
+
+def main():
+    path = sys.argv[1]
+    extended_subfield_code = sys.argv[2] if len(sys.argv) > 2 else '1'
+    encoding = sys.argv[3] if len(sys.argv) > 3 else 'utf-8'
+
+    records_bytes = read_records_bytes(path)
+    reader = Reader(path, extended_subfield_code=extended_subfield_code, encoding=encoding)
+    legacy_reader = LegacyReader(path, extended_subfield_code=extended_subfield_code, encoding=encoding)
+
+    for index, record_bytes in enumerate(records_bytes):
+        legacy_record = legacy_reader.decode_record(record_bytes)
+        new_record = reader.decode_record(record_bytes)
+        if record_to_json(legacy_record, dump=True) != record_to_json(new_record, dump=True):
+            print('Output differs for record', index)
+            sys.exit(1)
+    print('records', len(records_bytes), 'output identical')
+
+    legacy_time = measure(legacy_reader, records_bytes)
+    new_time = measure(reader, records_bytes)
+    print('legacy decoder %.3fs, %.0f records/s' % (legacy_time, len(records_bytes) / legacy_time))
+    print('current decoder %.3fs, %.0f records/s' % (new_time, len(records_bytes) / new_time))
+    print('speedup %.2fx' % (legacy_time / new_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+# encode: utf-8
+# Compact binary form of junimarc record:
+# header, stream of one byte operations, array of string lengths in characters
+# and all record strings joined in one utf-8 blob.
+import array
+import itertools
+import struct
+import sys
+
+from .. import record
+
+MAGIC = b'JMB'
+VERSION = 1
+# magic, version, string lengths typecode, operations count, strings count
+HEADER = struct.Struct('<3sBcII')
+
+# operation -> strings it takes: leader is always first string
+OP_CONTROL_FIELD = 1  # tag, data
+OP_DATA_FIELD = 2  # tag, ind1, ind2
+OP_DATA_SUBFIELD = 3  # code, data
+OP_EXTENDED_SUBFIELD = 4  # code, followed by fields of extended subfield up to OP_END
+OP_END = 5
+
+_SHORT_LENGTHS_TYPECODE = 'H'
+_LONG_LENGTHS_TYPECODE = 'I'
+
+
+def is_binary(content):
+    return content[:len(MAGIC)] == MAGIC
+
+
+def _fields_to_binary(fields, ops, strings):
+    for field in fields:
+        if isinstance(field, record.DataField):
+            ops.append(OP_DATA_FIELD)
+            strings += (field.get_tag(), field.get_ind1(), field.get_ind2())
+            for subfield in field.get_subfields():
+                if isinstance(subfield, record.DataSubfield):
+                    ops.append(OP_DATA_SUBFIELD)
+                    strings += (subfield.get_code(), subfield.get_data())
+                else:
+                    ops.append(OP_EXTENDED_SUBFIELD)
+                    strings.append(subfield.get_code())
+                    _fields_to_binary(subfield.get_fields(), ops, strings)
+                    ops.append(OP_END)
+        else:
+            ops.append(OP_CONTROL_FIELD)
+            strings += (field.get_tag(), field.get_data())
+
+
+def record_to_binary(jrecord):
+    ops = bytearray()
+    strings = [jrecord.get_leader() or '']
+    _fields_to_binary(jrecord.get_fields(), ops, strings)
+
+    lengths = [len(string) for string in strings]
+    typecode = _SHORT_LENGTHS_TYPECODE
+    if max(lengths) > 0xffff:
+        typecode = _LONG_LENGTHS_TYPECODE
+    lengths = array.array(typecode, lengths)
+    if sys.byteorder != 'little':
+        lengths.byteswap()
+
+    return b''.join((
+        HEADER.pack(MAGIC, VERSION, typecode.encode('ascii'), len(ops), len(strings)),
+        ops,
+        lengths.tobytes(),
+        ''.join(strings).encode('utf-8'),
+    ))
+
+
+def record_from_binary(content):
+    content = bytes(content)
+    if len(content) < HEADER.size:
+        raise ValueError('Binary record is shorter than header')
+
+    magic, version, typecode, ops_count, strings_count = HEADER.unpack_from(content)
+    if magic != MAGIC:
+        raise ValueError('Wrong binary record magic')
+    if version != VERSION:
+        raise ValueError('Unsupported binary record version %s' % str(version))
+
+    offset = HEADER.size
+    ops = content[offset: offset + ops_count]
+    offset += ops_count
+
+    lengths = array.array(typecode.decode('ascii'))
+    lengths_size = strings_count * lengths.itemsize
+    lengths.frombytes(content[offset: offset + lengths_size])
+    if sys.byteorder != 'little':
+        lengths.byteswap()
+    offset += lengths_size
+
+    text = content[offset:].decode('utf-8')
+    ends = list(itertools.accumulate(lengths))
+    strings = list(map(text.__getitem__, map(slice, [0] + ends[:-1], ends)))
+    if len(ops) != ops_count or not strings or len(strings) != strings_count or ends[-1] != len(text):
+        raise ValueError('Binary record is truncated')
+
+    next_string = iter(strings).__next__
+    data_subfield = record.DataSubfield
+    data_field = record.DataField
+    leader = next_string()
+    fields = []
+    current_fields = fields
+    current_subfields = None
+    stack = []
+    try:
+        for op in ops:
+            if op == OP_DATA_SUBFIELD:
+                current_subfields.append(data_subfield(next_string(), next_string()))
+            elif op == OP_DATA_FIELD:
+                current_subfields = []
+                current_fields.append(data_field(next_string(), next_string(), next_string(), current_subfields))
+            elif op == OP_CONTROL_FIELD:
+                current_fields.append(record.ControlField(next_string(), next_string()))
+                current_subfields = None
+            elif op == OP_EXTENDED_SUBFIELD:
+                extended_subfield_fields = []
+                current_subfields.append(record.ExtendedSubfield(code=next_string(), fields=extended_subfield_fields))
+                stack.append((current_fields, current_subfields))
+                current_fields = extended_subfield_fields
+                current_subfields = None
+            elif op == OP_END:
+                current_fields, current_subfields = stack.pop()
+            else:
+                raise ValueError('Unknown binary record operation %s' % str(op))
+    except (AttributeError, IndexError, StopIteration):
+        raise ValueError('Binary record operations are broken')
+
+    return record.Record(leader=leader, fields=fields)
@@ -0,0 +1,59 @@
+import bz2
+import gzip
+import io
+import lzma
+import zipfile
+
+GZIP = 'gzip'
+BZIP2 = 'bz2'
+XZ = 'xz'
+ZIP = 'zip'
+
+MAGIC_BYTES = (
+    (b'\x1f\x8b', GZIP),
+    (b'BZh', BZIP2),
+    (b'\xfd7zXZ\x00', XZ),
+    (b'PK\x03\x04', ZIP),
+)
+
+BUFFER_SIZE = 1024 * 1024
+
+
+def get_compression(path):
+    with io.open(path, 'rb') as fl:
+        head = fl.read(6)
+
+    for magic_bytes, compression in MAGIC_BYTES:
+        if head.startswith(magic_bytes):
+            return compression
+    return None
+
+
+def is_compressed(path):
+    return get_compression(path) is not None
+
+
+def open_file(path, buffering=BUFFER_SIZE):
+    compression = get_compression(path)
+
+    if compression == GZIP:
+        fl = gzip.open(path, 'rb')
+    elif compression == BZIP2:
+        fl = bz2.open(path, 'rb')
+    elif compression == XZ:
+        fl = lzma.open(path, 'rb')
+    elif compression == ZIP:
+        fl = _open_zip_member(path)
+    else:
+        return io.open(path, 'rb', buffering=buffering)
+
+    return io.BufferedReader(fl, buffer_size=buffering)
+
+
+def _open_zip_member(path):
+    with zipfile.ZipFile(path) as zip_file:
+        members = [info for info in zip_file.infolist() if not info.is_dir()]
+        if not members:
+            raise ValueError('Zip archive %s is empty' % path)
+        # member keeps archive file open until it is closed
+        return zip_file.open(members[0])
@@ -0,0 +1,123 @@
+import array
+import bisect
+import io
+import logging
+import os
+import struct
+
+from ..compression import open_file
+
+logger = logging.getLogger('junimarc.iso2709.index')
+
+INDEX_SUFFIX = '.jmidx'
+
+_MAGIC = b'JMIX'
+_VERSION = 1
+# magic, version, file size, file mtime in nanoseconds, offsets count
+_HEADER = struct.Struct('<4sBQqQ')
+_OFFSETS_TYPECODE = 'Q'
+
+_indexes = {}
+
+
+# record number -> (byte offset, length) index stored in sidecar file next to records file
+class RecordsIndex(object):
+    def __init__(self, path, index_path=None):
+        self.path = path
+        self.index_path = index_path or path + INDEX_SUFFIX
+        self.fingerprint = None
+        self._offsets = None
+
+    def get_fingerprint(self):
+        stat = os.stat(self.path)
+        return stat.st_size, stat.st_mtime_ns
+
+    def is_actual(self):
+        return self._offsets is not None and self.fingerprint == self.get_fingerprint()
+
+    def get_offsets(self):
+        if self.is_actual():
+            return self._offsets
+
+        fingerprint = self.get_fingerprint()
+        offsets = self._load(fingerprint)
+        if offsets is None:
+            offsets = self._build(fingerprint)
+            self._save(fingerprint, offsets)
+
+        self.fingerprint = fingerprint
+        self._offsets = offsets
+        return offsets
+
+    def get_position(self, index):
+        offsets = self.get_offsets()
+        if index < 0 or index >= len(offsets) - 1:
+            return None
+        offset = offsets[index]
+        return offset, offsets[index + 1] - offset
+
+    def get_index(self, offset):
+        offsets = self.get_offsets()
+        index = bisect.bisect_left(offsets, offset)
+        if index < len(offsets) - 1 and offsets[index] == offset:
+            return index
+        return None
+
+    def __len__(self):
+        return max(len(self.get_offsets()) - 1, 0)
+
+    def _build(self, fingerprint):
+        offsets = array.array(_OFFSETS_TYPECODE)
+        offset = 0
+        with open_file(self.path) as fl:
+            while True:
+                record_length_bytes = fl.read(5)
+                if not record_length_bytes:
+                    break
+                try:
+                    record_length = int(record_length_bytes)
+                except ValueError as e:
+                    logger.error('%s Offset %s' % (e, str(offset)))
+                    break
+
+                if record_length < 5 or len(fl.read(record_length - 5)) < record_length - 5:
+                    logger.error('Wrong record length %s Offset %s' % (str(record_length), str(offset)))
+                    break
+
+                offsets.append(offset)
+                offset += record_length
+        offsets.append(offset)
+        return offsets
+
+    def _load(self, fingerprint):
+        try:
+            with io.open(self.index_path, 'rb') as fl:
+                header = fl.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    return None
+                magic, version, size, mtime, count = _HEADER.unpack(header)
+                if magic != _MAGIC or version != _VERSION or (size, mtime) != fingerprint:
+                    return None
+                offsets = array.array(_OFFSETS_TYPECODE)
+                offsets.fromfile(fl, count)
+                return offsets
+        except (OSError, EOFError):
+            return None
+
+    def _save(self, fingerprint, offsets):
+        tmp_path = self.index_path + '.tmp'
+        try:
+            with io.open(tmp_path, 'wb') as fl:
+                fl.write(_HEADER.pack(_MAGIC, _VERSION, fingerprint[0], fingerprint[1], len(offsets)))
+                offsets.tofile(fl)
+            os.replace(tmp_path, self.index_path)
+        except OSError as e:
+            logger.warning('Can not save records index %s: %s' % (self.index_path, e))
+
+
+def get_records_index(path):
+    records_index = _indexes.get(path)
+    if records_index is None:
+        records_index = RecordsIndex(path)
+        _indexes[path] = records_index
+    return records_index
@@ -0,0 +1,108 @@
+import collections
+import io
+import logging
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from . import constants
+from .reader import Reader
+from ..compression import is_compressed
+from ..json.junimarc import record_to_json
+
+logger = logging.getLogger('junimarc.iso2709.parallel_reader')
+
+CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def _decode_chunk(path, start, end, extended_subfield_code, encoding, transform):
+    reader = Reader(path, extended_subfield_code=extended_subfield_code, encoding=encoding)
+    reader.offset = start
+    items = []
+    with io.open(path, 'rb') as fl:
+        with mmap.mmap(fl.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for record in reader._decode_records(reader._read_buffer(mm, end=end)):
+                if transform is not None:
+                    record = transform(record)
+                items.append((reader.index, reader.offset, record))
+    return items, reader.index, reader.offset
+
+
+class ParallelReader(object):
+    def __init__(self, path, extended_subfield_code='', encoding='utf=8', workers=None, chunk_size=CHUNK_SIZE,
+                 dump=False, transform=None):
+        self.path = path
+        self.encoding = encoding
+        self.extended_subfield_code = extended_subfield_code
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        # transform is applied to every record in worker process and must be picklable
+        if transform is None and dump:
+            transform = partial(record_to_json, dump=True)
+        self.transform = transform
+        self.offset = 0
+        self.index = 0
+
+    def get_chunks(self):
+        chunks = []
+        record_terminator = bytes((constants.RECORD_TERMINATOR,))
+        with io.open(self.path, 'rb') as fl:
+            file_size = os.fstat(fl.fileno()).st_size
+            if file_size == 0:
+                return chunks
+            with mmap.mmap(fl.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                start = 0
+                while start < file_size:
+                    end = mm.find(record_terminator, min(start + self.chunk_size, file_size) - 1)
+                    if end == -1:
+                        end = file_size
+                    else:
+                        end += 1
+                    chunks.append((start, end))
+                    start = end
+        return chunks
+
+    # yields (index, offset, record) in file order, record is transformed if transform is set
+    def read(self):
+        if is_compressed(self.path):
+            return self._read_sequential()
+        return self._read_parallel()
+
+    # compressed stream can not be split without decompressing it
+    def _read_sequential(self):
+        reader = Reader(self.path, extended_subfield_code=self.extended_subfield_code, encoding=self.encoding)
+        for record in reader.read():
+            if self.transform is not None:
+                record = self.transform(record)
+            self.index = reader.index
+            self.offset = reader.offset
+            yield self.index, self.offset, record
+        self.index = reader.index
+        self.offset = reader.offset
+
+    def _read_parallel(self):
+        chunks = collections.deque(self.get_chunks())
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            pending = collections.deque()
+            while chunks or pending:
+                while chunks and len(pending) < self.workers * 2:
+                    start, end = chunks.popleft()
+                    pending.append((start, executor.submit(
+                        _decode_chunk, self.path, start, end, self.extended_subfield_code, self.encoding, self.transform
+                    )))
+
+                start, future = pending.popleft()
+                items, chunk_records, chunk_end = future.result()
+                if start != self.offset:
+                    logger.error('Chunk at offset %s does not follow previous record end %s' % (
+                        str(start), str(self.offset)))
+
+                base_index = self.index
+                for local_index, offset, record in items:
+                    self.index = base_index + local_index
+                    self.offset = offset
+                    yield self.index, offset, record
+
+                self.index = base_index + chunk_records
+                self.offset = chunk_end
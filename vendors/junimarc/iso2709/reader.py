@@ -1,41 +1,246 @@
+import contextlib
+import itertools
 import logging
 import io
+import mmap
+import os
 from . import constants
 from .. import record
+from .. import record_batch
+from ..compression import is_compressed, open_file
 
 logger = logging.getLogger('junimarc.iso2709.reader')
 
+COUNT_BUFFER_SIZE = 1024 * 1024
+
+SUBFIELD_DELIMITER = bytes((constants.SUBFIELD_DELIMITER,))
+RECORD_TERMINATOR = bytes((constants.RECORD_TERMINATOR,))
+
+# path -> ((size, mtime), total records)
+_total_records_cache = {}
+
+
+def _read_exactly(fl, size):
+    data = fl.read(size)
+    if size < 0 or len(data) >= size or not data:
+        return data
+
+    chunks = [data]
+    remaining = size - len(data)
+    while remaining > 0:
+        chunk = fl.read(remaining)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
+
+
+# when batch is yielded by read_batches, offset and index of reader point to the first record after the batch
+def make_batches(records, batch_size):
+    batch = list(itertools.islice(records, batch_size))
+    while batch:
+        next_batch_record = next(records, None)
+        yield batch
+        if next_batch_record is None:
+            break
+        batch = [next_batch_record]
+        batch.extend(itertools.islice(records, batch_size - 1))
+
+
+class _PushbackReader(object):
+    def __init__(self, fl):
+        self.fl = fl
+        self.pending = b''
+
+    def read(self, size=-1):
+        if not self.pending:
+            return self.fl.read(size)
+        if size is None or size < 0:
+            data = self.pending + self.fl.read()
+            self.pending = b''
+            return data
+        data = self.pending[:size]
+        self.pending = self.pending[size:]
+        return data
+
+    def unread(self, data):
+        self.pending = data + self.pending
+
 
 class Reader(object):
-    def __init__(self, path, extended_subfield_code='', encoding='utf=8'):
+    def __init__(self, path, extended_subfield_code='', encoding='utf=8', use_mmap=False, lazy=False,
+                 include_tags=None, exclude_tags=None, recover=False, quarantine=None):
         self.path = path
         self.encoding = encoding
         self.extended_subfield_code = extended_subfield_code
+        self.use_mmap = use_mmap
+        self.lazy = lazy
+        self.include_tags = frozenset(include_tags) if include_tags is not None else None
+        self.exclude_tags = frozenset(exclude_tags) if exclude_tags is not None else None
+        # on broken record skip to next record terminator instead of stopping,
+        # quarantine(offset, length, bad_bytes, message) is called for every skipped byte range,
+        # bad_bytes are the first MAX_RECORD_LENGTH bytes of range
+        self.recover = recover
+        self.quarantine = quarantine
+        self.last_error = ''
         self.errors = []
         self.offset = 0
         self.index = 0
 
+    def is_stream(self):
+        return hasattr(self.path, 'read')
+
+    def open(self):
+        if self.is_stream():
+            return contextlib.nullcontext(self.path)
+        return open_file(self.path)
 
     def get_total_records(self):
-        total_records = 0
-        with io.open(self.path, 'rb', buffering=32 * 1024) as fl:
-            while True:
-                buff = fl.read(32 * 1024)
-                if not buff:
-                    break
-                for b in buff:
-                    if b == constants.RECORD_TERMINATOR:
-                        total_records += 1
+        if self.is_stream():
+            return self._count_stream_records(self.path)
+
+        stat = os.stat(self.path)
+        fingerprint = (stat.st_size, stat.st_mtime_ns)
+        cache_key = os.path.abspath(self.path)
+        cached = _total_records_cache.get(cache_key)
+        if cached is not None and cached[0] == fingerprint:
+            return cached[1]
+
+        with open_file(self.path) as fl:
+            total_records = self._count_records(fl)
+        _total_records_cache[cache_key] = (fingerprint, total_records)
+        return total_records
+
+    def _count_stream_records(self, fl):
+        if not fl.seekable():
+            raise ValueError('Can not count records in not seekable stream')
+        position = fl.tell()
+        try:
+            return self._count_records(fl)
+        finally:
+            fl.seek(position)
 
-                if total_records % 1000 == 0:
-                    print('tr', total_records)
+    def _count_records(self, fl):
+        total_records = 0
+        while True:
+            buff = fl.read(COUNT_BUFFER_SIZE)
+            if not buff:
+                break
+            total_records += buff.count(RECORD_TERMINATOR)
 
         return total_records
 
-    def read(self):
-        with io.open(self.path, 'rb', buffering=8 * 1024) as fl:
+    def read(self, offset=0, index=0):
+        return self._decode_records(self.read_raw(offset=offset, index=index))
+
+    # yields bytes of every record, offset and index point to the yielded record
+    def read_raw(self, offset=0, index=0):
+        self.offset = offset
+        self.index = index
+        if self.use_mmap and not self.is_stream() and not is_compressed(self.path):
+            return self._read_mmap()
+        return self._read_stream()
+
+    def _decode_records(self, records_bytes):
+        for record_bytes in records_bytes:
+            record = self._recover_decode(self.decode_record, record_bytes)
+
+            if record is not None:
+                record.set_errors(self.errors)
+                yield record
+            elif self.recover:
+                self._quarantine(record_bytes)
+
+    def read_batches(self, batch_size, offset=0, index=0):
+        return make_batches(self.read(offset=offset, index=index), batch_size)
+
+    # yields records as junimarc json dicts, same as record_to_json of records from read
+    def read_json(self, offset=0, index=0):
+        return self._decode_json_records(self.read_raw(offset=offset, index=index))
+
+    def read_json_batches(self, batch_size, offset=0, index=0):
+        return make_batches(self.read_json(offset=offset, index=index), batch_size)
+
+    # same as read_batches, but records are decoded into columnar RecordBatch instead of Record objects
+    def read_record_batches(self, batch_size, offset=0, index=0):
+        batch = self.make_record_batch()
+        for record_bytes in self.read_raw(offset=offset, index=index):
+            if len(batch) == batch_size:
+                yield batch
+                batch = self.make_record_batch()
+
+            if not self._recover_decode(self.decode_record_to_batch, record_bytes, batch) and self.recover:
+                self._quarantine(record_bytes)
+        if len(batch):
+            yield batch
+
+    def make_record_batch(self):
+        return record_batch.RecordBatch(encoding=self.encoding, extended_subfield_code=self.extended_subfield_code)
+
+    def _read_mmap(self):
+        with io.open(self.path, 'rb') as fl:
+            if os.fstat(fl.fileno()).st_size == 0:
+                return
+            with mmap.mmap(fl.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if hasattr(mmap, 'MADV_SEQUENTIAL'):
+                    mm.madvise(mmap.MADV_SEQUENTIAL)
+                yield from self._read_buffer(mm)
+
+    def _read_buffer(self, buffer, end=None):
+        if end is None:
+            end = len(buffer)
+        while self.offset < end:
+            record_length_bytes = bytes(buffer[self.offset: self.offset + 5])
+            if len(record_length_bytes) < 5:
+                self._log_error('Wrong record length')
+
+            try:
+                record_length = int(record_length_bytes)
+            except ValueError as e:
+                self._log_error(e)
+                if self.recover:
+                    self._resync_buffer(buffer)
+                    continue
+                break
+
+            if record_length < 5:
+                self._log_error('Wrong record length')
+                if self.recover:
+                    self._resync_buffer(buffer)
+                    continue
+                break
+
+            record_bytes = buffer[self.offset: self.offset + record_length]
+            total_record_length = len(record_bytes)
+            if total_record_length < record_length:
+                self._log_error('Total record length %s less then declared record length %s' % (
+                    str(total_record_length), str(record_length)))
+                if self.recover:
+                    self._resync_buffer(buffer)
+                    continue
+                break
+
+            if self.recover and record_bytes[-1] != constants.RECORD_TERMINATOR:
+                self._log_error('Record is not ended by record terminator')
+                self._resync_buffer(buffer)
+                continue
+
+            yield record_bytes
+
+            if self.errors:
+                self.errors = []
+            self.offset += total_record_length
+            self.index += 1
+
+    def _read_stream(self):
+        with self.open() as fl:
+            if self.offset:
+                fl.seek(self.offset)
+            if self.recover:
+                fl = _PushbackReader(fl)
             while True:
-                record_length_bytes = fl.read(5)
+                record_length_bytes = _read_exactly(fl, 5)
                 if not record_length_bytes:
                     break
                 if len(record_length_bytes) < 5:
@@ -45,33 +250,290 @@ class Reader(object):
                     record_length = int(record_length_bytes)
                 except ValueError as e:
                     self._log_error(e)
+                    if self.recover:
+                        self._resync_stream(fl, record_length_bytes)
+                        continue
                     break
-                record_bytes = fl.read(record_length - 5)
+
+                if self.recover and record_length < 5:
+                    self._log_error('Wrong record length')
+                    self._resync_stream(fl, record_length_bytes)
+                    continue
+
+                record_bytes = _read_exactly(fl, record_length - 5)
                 total_record_length = len(record_bytes) + 5
                 if total_record_length < record_length:
                     self._log_error('Total record length %s less then declared record length %s' % (
                         str(total_record_length), str(record_length)))
+                    if self.recover:
+                        self._resync_stream(fl, record_length_bytes + record_bytes)
+                        continue
                     break
 
-                record = self.decode_record(bytearray(record_length_bytes + record_bytes))
+                record_bytes = record_length_bytes + record_bytes
+                if self.recover and record_bytes[-1] != constants.RECORD_TERMINATOR:
+                    self._log_error('Record is not ended by record terminator')
+                    self._resync_stream(fl, record_bytes)
+                    continue
 
-                if record is not None:
-                    record.set_errors(self.errors)
-                    yield record
+                yield record_bytes
 
                 if self.errors:
                     self.errors = []
                 self.offset += total_record_length
                 self.index += 1
 
+    # skips bytes up to next record terminator, skipped range is one record position
+    def _resync_buffer(self, buffer):
+        terminator_position = buffer.find(RECORD_TERMINATOR, self.offset)
+        if terminator_position == -1:
+            resync_offset = len(buffer)
+        else:
+            resync_offset = terminator_position + 1
+        length = resync_offset - self.offset
+        self._quarantine(buffer[self.offset: self.offset + min(length, constants.MAX_RECORD_LENGTH)], length)
+        self._skip(length)
+
+    # only the first MAX_RECORD_LENGTH skipped bytes are kept, file without terminators is not loaded whole
+    def _resync_stream(self, fl, consumed_bytes):
+        chunk = consumed_bytes
+        bad_bytes = b''
+        length = 0
+        while True:
+            terminator_position = chunk.find(RECORD_TERMINATOR)
+            if terminator_position != -1:
+                fl.unread(chunk[terminator_position + 1:])
+                chunk = chunk[:terminator_position + 1]
+            length += len(chunk)
+            if len(bad_bytes) < constants.MAX_RECORD_LENGTH:
+                bad_bytes += chunk[:constants.MAX_RECORD_LENGTH - len(bad_bytes)]
+            if terminator_position != -1:
+                break
+            chunk = fl.read(COUNT_BUFFER_SIZE)
+            if not chunk:
+                break
+        self._quarantine(bad_bytes, length)
+        self._skip(length)
+
+    def _skip(self, length):
+        self.errors = []
+        self.offset += length
+        self.index += 1
+
+    def _quarantine(self, bad_bytes, length=None):
+        if length is None:
+            length = len(bad_bytes)
+        if self.quarantine is not None:
+            self.quarantine(self.offset, length, bytes(bad_bytes), self.last_error)
+
+    # in recover mode record which fields can not be decoded is broken as well
+    def _recover_decode(self, decode, record_bytes, *args):
+        if not self.recover:
+            return decode(record_bytes, *args)
+        try:
+            return decode(record_bytes, *args)
+        except ValueError as e:
+            self._log_error(e)
+            return None
+
+    def read_record(self, offset, length, index=0):
+        self.offset = offset
+        self.index = index
+        with self.open() as fl:
+            fl.seek(offset)
+            record_bytes = _read_exactly(fl, length)
+
+        if len(record_bytes) < length:
+            self._log_error('Total record length %s less then declared record length %s' % (
+                str(len(record_bytes)), str(length)))
+            return None
+
+        record = self.decode_record(record_bytes)
+        if record is not None:
+            record.set_errors(self.errors)
+        self.errors = []
+        return record
+
     def decode_record(self, record_bytes):
+        parsed_record = self.parse_record(record_bytes)
+        if parsed_record is None:
+            return None
+        leader, field_entries = parsed_record
+
+        if self.lazy:
+            if isinstance(record_bytes, memoryview):
+                record_bytes = record_bytes.tobytes()
+            return record.LazyRecord(
+                leader=leader.decode(self.encoding),
+                record_bytes=record_bytes,
+                field_entries=field_entries,
+                field_decoder=self.decode_lazy_field
+            )
+
+        fields = [
+            self.decode_field(tag, record_bytes[field_start: field_end])
+            for tag, field_start, field_end in field_entries
+        ]
+
+        jrecord = record.Record(leader=leader.decode(self.encoding), fields=fields)
+
+        return jrecord
+
+    def _decode_json_records(self, records_bytes):
+        for record_bytes in records_bytes:
+            record_json = self._recover_decode(self.decode_record_to_json, record_bytes)
+
+            if record_json is not None:
+                yield record_json
+            elif self.recover:
+                self._quarantine(record_bytes)
+
+    # builds the same dict as record_to_json(self.decode_record(record_bytes))
+    # without intermediate record objects
+    def decode_record_to_json(self, record_bytes):
+        parsed_record = self.parse_record(record_bytes)
+        if parsed_record is None:
+            return None
+        leader, field_entries = parsed_record
+
+        encoding = self.encoding
+        cf = []
+        df = []
+        for tag, field_start, field_end in field_entries:
+            field_bytes = record_bytes[field_start: field_end]
+            if int(tag) < 10:
+                cf.append({
+                    'tag': tag,
+                    'd': str(field_bytes, encoding),
+                })
+            else:
+                df.append(self.decode_data_field_to_json(tag, field_bytes))
+
+        return {
+            'l': leader.decode(encoding),
+            'cf': cf,
+            'df': df,
+        }
+
+    def decode_data_field_to_json(self, tag, field_bytes):
+        field_length = len(field_bytes)
+        ind1 = chr(field_bytes[0]) if field_length > 0 else u' '
+        ind2 = chr(field_bytes[1]) if field_length > 1 else u' '
+
+        sf = []
+        esf = []
+        if field_length > 3:
+            if not isinstance(field_bytes, bytes):
+                field_bytes = bytes(field_bytes)
+
+            if field_bytes.find(SUBFIELD_DELIMITER) == 2:
+                subfields_bytes = field_bytes.split(SUBFIELD_DELIMITER)
+                del subfields_bytes[0]
+            else:
+                subfields_bytes = field_bytes[3:].split(SUBFIELD_DELIMITER)
+
+            encoding = self.encoding
+            for subfield_bytes in subfields_bytes:
+                if subfield_bytes:
+                    sf.append({
+                        'id': chr(subfield_bytes[0]),
+                        'd': subfield_bytes[1:].decode(encoding),
+                    })
+
+            if self.extended_subfield_code and (
+                    SUBFIELD_DELIMITER + self.extended_subfield_code.encode('latin-1')) in field_bytes:
+                esf = self.decode_extended_subfield_to_json(sf)
+                if esf:
+                    sf = []
+
+        return {
+            'tag': tag,
+            'i1': ind1,
+            'i2': ind2,
+            'sf': sf,
+            'esf': esf,
+        }
+
+    # json counterpart of decode_extended_subfield, returns esf list for subfields dicts
+    def decode_extended_subfield_to_json(self, sf):
+        esf = []
+        next_field = None
+        extended_code = ''
+        for subfield in sf:
+            code = subfield['id']
+            data = subfield['d']
+            if code == self.extended_subfield_code:
+                extended_code = code
+                if next_field is not None:
+                    esf.append({'id': extended_code, 'cf': [], 'df': [next_field]})
+                    next_field = None
+
+                if len(data) < 5:
+                    continue
+
+                tag = data[0: 3]
+                try:
+                    int_tag = int(tag)
+                except ValueError as e:
+                    self.errors.append(str(e))
+                    self._log_error(e)
+                    continue
+
+                if int_tag < 10:
+                    esf.append({'id': extended_code, 'cf': [{'tag': tag, 'd': data[3:]}], 'df': []})
+                else:
+                    next_field = {
+                        'tag': tag,
+                        'i1': data[3:4] or ' ',
+                        'i2': data[4:5] or ' ',
+                        'sf': [],
+                        'esf': [],
+                    }
+            elif next_field is not None:
+                next_field['sf'].append(subfield)
+
+        if next_field is not None:
+            esf.append({'id': extended_code, 'cf': [], 'df': [next_field]})
+        return esf
+
+    def decode_record_to_batch(self, record_bytes, batch):
+        parsed_record = self.parse_record(record_bytes)
+        if parsed_record is None:
+            return False
+        leader, field_entries = parsed_record
+
+        # tags are checked before record is added, so broken record does not leave its part in batch
+        control_fields = [int(tag) < 10 for tag, field_start, field_end in field_entries]
+        batch.begin_record(leader)
+        for (tag, field_start, field_end), is_control_field in zip(field_entries, control_fields):
+            field_bytes = bytes(record_bytes[field_start: field_end])
+            if is_control_field:
+                batch.add_field(tag)
+                batch.add_subfield(record_batch.CONTROL_FIELD_CODE, field_bytes)
+                continue
+
+            batch.add_field(tag, field_bytes[0:2].ljust(2))
+            if len(field_bytes) > 3:
+                if field_bytes.find(SUBFIELD_DELIMITER) == 2:
+                    subfields_bytes = field_bytes.split(SUBFIELD_DELIMITER)
+                    del subfields_bytes[0]
+                else:
+                    subfields_bytes = field_bytes[3:].split(SUBFIELD_DELIMITER)
+                for subfield_bytes in subfields_bytes:
+                    if subfield_bytes:
+                        batch.add_subfield(subfield_bytes[0], subfield_bytes[1:])
+        return True
+
+    # returns (leader bytes, list of (tag, start, end) of field data) or None if record is broken
+    def parse_record(self, record_bytes):
         record_bytes_length = len(record_bytes)
         if record_bytes_length < constants.LEADER_LENGTH:
             self._log_error('record bytes length less then leader length')
             return None
 
+        leader = bytes(record_bytes[0: constants.LEADER_LENGTH])
         try:
-            record_length = int(record_bytes[0:5])
+            record_length = int(leader[0:5])
         except ValueError as e:
             self._log_error(e)
             return None
@@ -83,33 +545,52 @@ class Reader(object):
             return None
 
         try:
-            base_address = int(record_bytes[12:17])
+            base_address = int(leader[12:17])
         except ValueError as e:
             self._log_error(e)
             return None
 
-        leader = record_bytes[0: constants.LEADER_LENGTH]
-        offset = constants.LEADER_LENGTH
-
-        fields = []
-        while offset < base_address - 1:
-            tag = record_bytes[offset: offset + 3]
-            offset += 3
-            field_length = int(record_bytes[offset: offset + 4])
-            offset += 4
-            field_starting_position = int(record_bytes[offset: offset + 5])
-            offset += 5
-            field_offset = base_address + field_starting_position
-            fields.append(
-                self.decode_field(
-                    tag.decode(self.encoding),
-                    record_bytes[field_offset: field_offset + field_length - 1]
-                )
-            )
+        directory = bytes(record_bytes[constants.LEADER_LENGTH: base_address - 1])
+        try:
+            field_entries = self.parse_directory(directory, base_address)
+        except ValueError as e:
+            self._log_error(e)
+            return None
 
-        jrecord = record.Record(leader=leader.decode(self.encoding), fields=fields)
+        return leader, field_entries
+
+    # returns list of (tag, start, end) of field data in record bytes
+    def parse_directory(self, directory, base_address):
+        is_ascii_directory = directory.isascii()
+        if is_ascii_directory:
+            directory = directory.decode('ascii')
+        select_tags = self.include_tags is not None or self.exclude_tags is not None
+
+        field_entries = []
+        for offset in range(0, len(directory), constants.DIRECTORY_ENTRY_LENGTH):
+            tag = directory[offset: offset + 3]
+            if not is_ascii_directory:
+                tag = tag.decode(self.encoding)
+            if select_tags and not self.is_tag_selected(tag):
+                continue
+            field_start = base_address + int(directory[offset + 7: offset + 12])
+            field_entries.append((tag, field_start, field_start + int(directory[offset + 3: offset + 7]) - 1))
+        return field_entries
+
+    def decode_lazy_field(self, tag, field_bytes, errors):
+        reader_errors = self.errors
+        self.errors = errors
+        try:
+            return self.decode_field(tag, field_bytes)
+        finally:
+            self.errors = reader_errors
 
-        return jrecord
+    def is_tag_selected(self, tag):
+        if self.include_tags is not None and tag not in self.include_tags:
+            return False
+        if self.exclude_tags is not None and tag in self.exclude_tags:
+            return False
+        return True
 
     def decode_field(self, tag, field_bytes):
         if int(tag) < 10:
@@ -118,7 +599,7 @@ class Reader(object):
             return self.decode_data_field(tag, field_bytes)
 
     def decode_control_field(self, tag, field_bytes):
-        return record.ControlField(tag, data=field_bytes.decode(self.encoding))
+        return record.ControlField(tag, data=str(field_bytes, self.encoding))
 
     def decode_data_field(self, tag, field_bytes):
         field_length = len(field_bytes)
@@ -136,28 +617,34 @@ class Reader(object):
         field = record.DataField(tag=tag, ind1=ind1, ind2=ind2, subfields=subfields)
 
         if field_length > 3:
-            start_of_subfield_index = 3
-            end_of_subfield_index = start_of_subfield_index
-            while end_of_subfield_index < field_length:
-                if field_bytes[end_of_subfield_index] == constants.SUBFIELD_DELIMITER:
-                    subfields.append(
-                        self.decode_data_subfield(field_bytes[start_of_subfield_index: end_of_subfield_index]))
-                    end_of_subfield_index += 1
-                    start_of_subfield_index = end_of_subfield_index
-                else:
-                    end_of_subfield_index += 1
-            if start_of_subfield_index != end_of_subfield_index:
-                subfields.append(self.decode_data_subfield(field_bytes[start_of_subfield_index: end_of_subfield_index]))
+            if not isinstance(field_bytes, bytes):
+                field_bytes = bytes(field_bytes)
 
-        if self.extended_subfield_code and field.get_subfields(self.extended_subfield_code):
-            self.decode_extended_subfield(field)
+            # subfields start after indicators and first delimiter
+            if field_bytes.find(SUBFIELD_DELIMITER) == 2:
+                subfields_bytes = field_bytes.split(SUBFIELD_DELIMITER)
+                del subfields_bytes[0]
+            else:
+                subfields_bytes = field_bytes[3:].split(SUBFIELD_DELIMITER)
+
+            encoding = self.encoding
+            for subfield_bytes in subfields_bytes:
+                if subfield_bytes:
+                    subfields.append(record.DataSubfield(
+                        code=chr(subfield_bytes[0]),
+                        data=subfield_bytes[1:].decode(encoding)
+                    ))
+
+            if self.extended_subfield_code and (
+                    SUBFIELD_DELIMITER + self.extended_subfield_code.encode('latin-1')) in field_bytes:
+                self.decode_extended_subfield(field)
         return field
 
     def decode_data_subfield(self, subfield_bytes):
         code = chr(subfield_bytes[0])
         return record.DataSubfield(
             code=code,
-            data=subfield_bytes[1: len(subfield_bytes)].decode(self.encoding)
+            data=str(subfield_bytes[1: len(subfield_bytes)], self.encoding)
         )
 
     def decode_extended_subfield(self, field):
@@ -203,4 +690,5 @@ class Reader(object):
             field.set_subfields(extended_subfields)
 
     def _log_error(self, message):
+        self.last_error = str(message)
         logger.error('%s Offset %s' % (message, str(self.offset)))
@@ -1,4 +1,3 @@
-from collections import OrderedDict
 from .record import Record, ControlField, DataField, DataSubfield, ExtendedSubfield
 
 
@@ -128,23 +127,9 @@ class MarcQuery(object):
             raise TypeError('record must be instance of junimarc Record')
 
         self.record = record
-        self.fields_index = None
 
     def get_field(self, tag):
-        if self.fields_index is None:
-            self.__build_index()
-
-        fields = self.fields_index.get(tag, [])
-        return FieldQuery(fields)
+        return FieldQuery(self.record.get_fields(tag))
 
     def get_element(self):
         return self.record
-
-    def __build_index(self):
-        self.fields_index = OrderedDict()
-        for field in self.record.get_fields():
-            exist_fields = self.fields_index.get(field.get_tag())
-            if exist_fields is None:
-                exist_fields = []
-                self.fields_index[field.get_tag()] = exist_fields
-            exist_fields.append(field)
@@ -1,9 +1,33 @@
 # encode: utf-8
+from sys import intern
+
+
+# tag -> items or code -> items index, built on first lookup and dropped on mutation
+def _build_index(items, get_key):
+    index = {}
+    for item in items:
+        key = get_key(item)
+        exist_items = index.get(key)
+        if exist_items is None:
+            index[key] = [item]
+        else:
+            exist_items.append(item)
+    return index
+
+
+def _get_tag(field):
+    return field.get_tag()
+
+
+def _get_code(subfield):
+    return subfield.get_code()
 
 
 class DataSubfield(object):
+    __slots__ = ('__code', '__data')
+
     def __init__(self, code, data):
-        self.__code = code
+        self.__code = intern(code)
         self.__data = data
 
     def get_code(self):
@@ -20,9 +44,14 @@ class DataSubfield(object):
 
 
 class ExtendedSubfield(object):
-    def __init__(self, code, fields=list()):
-        self.__code = code
+    __slots__ = ('__code', '__fields', '__index')
+
+    def __init__(self, code, fields=None):
+        if fields is None:
+            fields = []
+        self.__code = intern(code)
         self.__fields = fields
+        self.__index = None
 
     def get_code(self):
         return self.__code
@@ -30,7 +59,9 @@ class ExtendedSubfield(object):
     def get_fields(self, tag=None):
         if not tag:
             return self.__fields
-        return [field for field in self.__fields if field.get_tag() == tag]
+        if self.__index is None:
+            self.__index = _build_index(self.__fields, _get_tag)
+        return list(self.__index.get(tag, ()))
 
     def __str__(self):
         lines = ['$' + self.__code]
@@ -45,17 +76,14 @@ class ExtendedSubfield(object):
         return u"".join(lines)
 
     def __getitem__(self, item):
-        uitem = str(item)
-        fields = []
-        for field in self.__fields:
-            if field.get_tag() == uitem:
-                fields.append(field)
-        return fields
+        return self.get_fields(str(item))
 
 
 class ControlField(object):
+    __slots__ = ('__tag', '__data')
+
     def __init__(self, tag, data):
-        self.__tag = tag
+        self.__tag = intern(tag)
         self.__data = data
 
     def get_tag(self):
@@ -72,13 +100,16 @@ class ControlField(object):
 
 
 class DataField(object):
+    __slots__ = ('__tag', '__ind1', '__ind2', '__subfields', '__index')
+
     def __init__(self, tag, ind1=' ', ind2=' ', subfields=None):
         if subfields is None:
             subfields = []
-        self.__tag = tag
+        self.__tag = intern(tag)
         self.__ind1 = ind1
         self.__ind2 = ind2
         self.__subfields = subfields
+        self.__index = None
 
     def get_tag(self):
         return self.__tag
@@ -92,13 +123,17 @@ class DataField(object):
     def get_subfields(self, code=None):
         if not code:
             return self.__subfields
-        return [subfield for subfield in self.__subfields if subfield.get_code() == code]
+        if self.__index is None:
+            self.__index = _build_index(self.__subfields, _get_code)
+        return list(self.__index.get(code, ()))
 
     def set_subfields(self, subfields):
         self.__subfields = subfields
+        self.__index = None
 
     def append_subfield(self, subfield):
         self.__subfields.append(subfield)
+        self.__index = None
 
     def __str__(self):
         lines = ['%s %s%s' % (self.__tag, self.__ind1.replace(' ', '#'), self.__ind2.replace(' ', '#'))]
@@ -114,21 +149,19 @@ class DataField(object):
         return ' '.join(lines)
 
     def __getitem__(self, item):
-        uitem = item
-        subfields = []
-        for subfield in self.__subfields:
-            if subfield.get_code() == uitem:
-                subfields.append(subfield)
-        return subfields
+        return self.get_subfields(item)
 
 
 class Record(object):
+    __slots__ = ('__errors', '__leader', '__fields', '__index')
+
     def __init__(self, leader='00000       00000       ', fields=None):
         if fields is None:
             fields = []
         self.__errors = []
         self.__leader = leader
         self.__fields = fields
+        self.__index = None
 
     def get_leader(self):
         return self.__leader
@@ -136,20 +169,23 @@ class Record(object):
     def get_fields(self, tag=None):
         if not tag:
             return self.__fields
-        return [field for field in self.__fields if field.get_tag() == tag]
+        if self.__index is None:
+            self.__index = _build_index(self.__fields, _get_tag)
+        return list(self.__index.get(tag, ()))
 
     def add_fields(self, fields=list()):
         self.__fields += fields
+        self.__index = None
 
     def __str__(self):
         lines = [self.__leader]
-        for field in self.__fields:
+        for field in self.get_fields():
             lines.append(str(field))
         return u"\n".join(lines)
 
     def to_html(self):
         lines = ['<div class="leader">%s</div>' % self.__leader.replace(' ', '&nbsp;')]
-        for field in self.__fields:
+        for field in self.get_fields():
             lines.append("<div class='field'>%s</div>" % field.to_html())
         return u"".join(lines)
 
@@ -163,10 +199,42 @@ class Record(object):
         attr = getattr(self, item, None)
         if attr:
             return attr
-        uitem = item
-        fields = []
-        for field in self.__fields:
-            if field.get_tag() == uitem:
-                fields.append(field)
-        return fields
+        return self.get_fields(item)
+
+
+class LazyRecord(Record):
+    __slots__ = ('__record_bytes', '__field_entries', '__field_decoder', '__fields', '__positions')
+
+    # field_entries is list of (tag, start, end) of field data in record_bytes,
+    # field is decoded by field_decoder(tag, field_bytes, errors) on first access
+    def __init__(self, leader, record_bytes, field_entries, field_decoder):
+        super(LazyRecord, self).__init__(leader=leader)
+        self.__record_bytes = record_bytes
+        self.__field_entries = field_entries
+        self.__field_decoder = field_decoder
+        self.__fields = [None] * len(field_entries)
+        self.__positions = None
+
+    def __get_field(self, position):
+        field = self.__fields[position]
+        if field is None:
+            tag, start, end = self.__field_entries[position]
+            field = self.__field_decoder(tag, self.__record_bytes[start: end], self.get_errors())
+            self.__fields[position] = field
+        return field
 
+    def get_fields(self, tag=None):
+        if not tag:
+            return [self.__get_field(position) for position in range(len(self.__field_entries))]
+        if self.__positions is None:
+            self.__positions = _build_index(range(len(self.__field_entries)), self.__get_entry_tag)
+        return [self.__get_field(position) for position in self.__positions.get(tag, ())]
+
+    def __get_entry_tag(self, position):
+        return self.__field_entries[position][0]
+
+    def add_fields(self, fields=list()):
+        for field in fields:
+            self.__field_entries.append((field.get_tag(), 0, 0))
+            self.__fields.append(field)
+        self.__positions = None
@@ -0,0 +1,187 @@
+# encode: utf-8
+import array
+import bisect
+
+from . import record
+from .iso2709 import reader as iso2709_reader
+
+# pseudo subfield code of control field data
+CONTROL_FIELD_CODE = 0
+
+TAG_LENGTH = 3
+INDICATORS_LENGTH = 2
+
+_OFFSETS_TYPECODE = 'Q'
+
+
+# Batch of records stored in flat arrays instead of object per field and subfield.
+# Each level keeps start position of its items in next level:
+# record -> first field, field -> first subfield, subfield -> first byte of data.
+# Item end is start of next item or length of next level for the last item.
+# Extended subfields are stored flat as in iso2709 and nested again on conversion to Record.
+class RecordBatch(object):
+    def __init__(self, encoding='utf-8', extended_subfield_code=''):
+        self.encoding = encoding
+        self.extended_subfield_code = extended_subfield_code
+        self.leaders = bytearray()
+        self.leader_offsets = array.array(_OFFSETS_TYPECODE)
+        self.record_fields = array.array(_OFFSETS_TYPECODE)
+        self.tags = bytearray()
+        self.indicators = bytearray()
+        self.field_subfields = array.array(_OFFSETS_TYPECODE)
+        self.codes = bytearray()
+        self.subfield_data = array.array(_OFFSETS_TYPECODE)
+        self.data = bytearray()
+        self._decoder = None
+
+    def __len__(self):
+        return len(self.record_fields)
+
+    def get_fields_count(self):
+        return len(self.field_subfields)
+
+    def get_subfields_count(self):
+        return len(self.codes)
+
+    def begin_record(self, leader):
+        if isinstance(leader, str):
+            leader = leader.encode(self.encoding)
+        self.leader_offsets.append(len(self.leaders))
+        self.leaders += leader
+        self.record_fields.append(len(self.field_subfields))
+
+    def add_field(self, tag, indicators=b'  '):
+        self.tags += tag.encode(self.encoding)
+        self.indicators += indicators
+        self.field_subfields.append(len(self.codes))
+
+    # code is byte value, data is encoded bytes
+    def add_subfield(self, code, data):
+        self.codes.append(code)
+        self.subfield_data.append(len(self.data))
+        self.data += data
+
+    def add_record(self, jrecord):
+        self.begin_record(jrecord.get_leader())
+        for field in jrecord.get_fields():
+            self._add_field(field)
+
+    def _add_field(self, field):
+        if isinstance(field, record.ControlField):
+            self.add_field(field.get_tag())
+            self.add_subfield(CONTROL_FIELD_CODE, field.get_data().encode(self.encoding))
+            return
+
+        self.add_field(field.get_tag(), (field.get_ind1() + field.get_ind2()).encode('latin-1'))
+        self._add_subfields(field.get_subfields())
+
+    def _add_subfields(self, subfields):
+        for subfield in subfields:
+            code = ord(subfield.get_code())
+            if isinstance(subfield, record.ExtendedSubfield):
+                for field in subfield.get_fields():
+                    if isinstance(field, record.ControlField):
+                        self.add_subfield(code, (field.get_tag() + field.get_data()).encode(self.encoding))
+                    else:
+                        self.add_subfield(code, (
+                            field.get_tag() + field.get_ind1() + field.get_ind2()).encode(self.encoding))
+                        self._add_subfields(field.get_subfields())
+            else:
+                self.add_subfield(code, subfield.get_data().encode(self.encoding))
+
+    def get_record_fields_range(self, record_index):
+        return self.record_fields[record_index], self._get_end(self.record_fields, record_index,
+                                                               len(self.field_subfields))
+
+    def get_field_subfields_range(self, field_index):
+        return self.field_subfields[field_index], self._get_end(self.field_subfields, field_index, len(self.codes))
+
+    def get_leader(self, record_index):
+        start = self.leader_offsets[record_index]
+        end = self._get_end(self.leader_offsets, record_index, len(self.leaders))
+        return self.leaders[start: end].decode(self.encoding)
+
+    def get_tag(self, field_index):
+        start = field_index * TAG_LENGTH
+        return self.tags[start: start + TAG_LENGTH].decode(self.encoding)
+
+    def get_indicators(self, field_index):
+        start = field_index * INDICATORS_LENGTH
+        return self.indicators[start: start + INDICATORS_LENGTH].decode('latin-1')
+
+    def get_subfield_data(self, subfield_index):
+        return self.get_subfield_bytes(subfield_index).decode(self.encoding)
+
+    def get_subfield_bytes(self, subfield_index):
+        start = self.subfield_data[subfield_index]
+        end = self._get_end(self.subfield_data, subfield_index, len(self.data))
+        return self.data[start: end]
+
+    def get_record_index(self, field_index):
+        return bisect.bisect_right(self.record_fields, field_index) - 1
+
+    # indexes of fields with tag in all records of batch
+    def find_fields(self, tag):
+        tag_bytes = tag.encode(self.encoding)
+        field_indexes = []
+        position = self.tags.find(tag_bytes)
+        while position != -1:
+            if position % TAG_LENGTH == 0:
+                field_indexes.append(position // TAG_LENGTH)
+                position = self.tags.find(tag_bytes, position + TAG_LENGTH)
+            else:
+                position = self.tags.find(tag_bytes, position + 1)
+        return field_indexes
+
+    # yields (record index, data) of subfields with code in fields with tag,
+    # control field data is returned when code is not set
+    def iter_values(self, tag, code=None):
+        code = ord(code) if code else CONTROL_FIELD_CODE
+        codes = self.codes
+        for field_index in self.find_fields(tag):
+            start, end = self.get_field_subfields_range(field_index)
+            position = codes.find(code, start, end)
+            if position == -1:
+                continue
+            record_index = self.get_record_index(field_index)
+            while position != -1:
+                yield record_index, self.get_subfield_data(position)
+                position = codes.find(code, position + 1, end)
+
+    def to_record(self, record_index):
+        start, end = self.get_record_fields_range(record_index)
+        fields = [self.to_field(field_index) for field_index in range(start, end)]
+        return record.Record(leader=self.get_leader(record_index), fields=fields)
+
+    def to_records(self):
+        return [self.to_record(record_index) for record_index in range(len(self))]
+
+    def to_field(self, field_index):
+        tag = self.get_tag(field_index)
+        start, end = self.get_field_subfields_range(field_index)
+        if int(tag) < 10:
+            data = self.get_subfield_data(start) if start < end else ''
+            return record.ControlField(tag, data)
+
+        indicators = self.get_indicators(field_index)
+        subfields = [
+            record.DataSubfield(code=chr(self.codes[subfield_index]), data=self.get_subfield_data(subfield_index))
+            for subfield_index in range(start, end)
+        ]
+        field = record.DataField(tag=tag, ind1=indicators[0], ind2=indicators[1], subfields=subfields)
+
+        if self.extended_subfield_code and ord(self.extended_subfield_code) in self.codes[start: end]:
+            self._get_decoder().decode_extended_subfield(field)
+        return field
+
+    def _get_decoder(self):
+        if self._decoder is None:
+            self._decoder = iso2709_reader.Reader(
+                None, extended_subfield_code=self.extended_subfield_code, encoding=self.encoding)
+        return self._decoder
+
+    @staticmethod
+    def _get_end(starts, index, total):
+        if index + 1 < len(starts):
+            return starts[index + 1]
+        return total
@@ -0,0 +1,33 @@
+# encode: utf-8
+# Run from vendors directory: python -m unittest discover junimarc.tests
+FIELD_TERMINATOR = b'\x1e'
+RECORD_TERMINATOR = b'\x1d'
+SUBFIELD_DELIMITER = '\x1f'
+
+
+# iso2709 record of (tag, data) fields, data of data field starts with indicators
+def make_iso_record(fields, encoding='utf-8'):
+    directory = b''
+    data = b''
+    for tag, field_data in fields:
+        field_bytes = field_data.encode(encoding) + FIELD_TERMINATOR
+        directory += tag.encode('ascii') + b'%04d%05d' % (len(field_bytes), len(data))
+        data += field_bytes
+    base_address = 24 + len(directory) + 1
+    leader = b'%05dnam  22%05d   450 ' % (base_address + len(data) + 1, base_address)
+    return leader + directory + FIELD_TERMINATOR + data + RECORD_TERMINATOR
+
+
+def sf(code, data):
+    return SUBFIELD_DELIMITER + code + data
+
+
+# rusmarc record, 461 holds linked record in $1 extended subfields
+RUSMARC_FIELDS = [
+    ('001', 'RU\\NLR\\1'),
+    ('005', '20200101120000.0'),
+    ('200', '1 ' + sf('a', 'Война и мир') + sf('e', 'роман')),
+    ('461', ' 0' + sf('1', '001RU\\NLR\\0') + sf('1', '2001 ') + sf('a', 'Собрание сочинений') +
+     sf('v', 'т. 1')),
+    ('700', ' 1' + sf('a', 'Толстой') + sf('b', 'Л. Н.')),
+]
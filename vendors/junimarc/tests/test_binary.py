@@ -0,0 +1,97 @@
+# encode: utf-8
+import unittest
+
+from junimarc import record
+from junimarc.binary.junimarc import HEADER, OP_DATA_SUBFIELD, OP_END, is_binary, record_from_binary, \
+    record_to_binary
+from junimarc.iso2709.reader import Reader
+from junimarc.json.junimarc import record_to_json
+
+from . import RUSMARC_FIELDS, make_iso_record
+
+
+def decode_rusmarc_record():
+    return Reader(None, extended_subfield_code='1', encoding='utf-8').decode_record(make_iso_record(RUSMARC_FIELDS))
+
+
+class BinaryRecordTests(unittest.TestCase):
+    def assert_round_trip(self, jrecord):
+        content = record_to_binary(jrecord)
+        self.assertTrue(is_binary(content))
+        self.assertEqual(record_to_json(record_from_binary(content)), record_to_json(jrecord))
+        return content
+
+    def test_round_trip(self):
+        self.assert_round_trip(decode_rusmarc_record())
+
+    def test_round_trip_extended_subfields(self):
+        jrecord = record_from_binary(self.assert_round_trip(decode_rusmarc_record()))
+        extended_subfields = jrecord.get_fields('461')[0].get_subfields()
+        self.assertEqual([type(subfield) for subfield in extended_subfields], [record.ExtendedSubfield] * 2)
+        control_field, data_field = [subfield.get_fields()[0] for subfield in extended_subfields]
+        self.assertEqual((control_field.get_tag(), control_field.get_data()), ('001', 'RU\\NLR\\0'))
+        self.assertEqual(data_field.get_subfields('a')[0].get_data(), 'Собрание сочинений')
+
+    def test_round_trip_empty_record(self):
+        self.assert_round_trip(record.Record(leader='', fields=[]))
+
+    def test_round_trip_long_strings(self):
+        jrecord = record.Record(fields=[
+            record.ControlField('001', 'id'),
+            record.DataField('330', subfields=[
+                record.DataSubfield('a', 'x' * 0x10000),
+                record.DataSubfield('b', 'я' * 0x10001),
+            ]),
+        ])
+        content = self.assert_round_trip(jrecord)
+        self.assertEqual(HEADER.unpack_from(content)[2], b'I')
+
+    def test_short_strings_lengths(self):
+        self.assertEqual(HEADER.unpack_from(record_to_binary(decode_rusmarc_record()))[2], b'H')
+
+    def test_json_content_is_not_binary(self):
+        self.assertFalse(is_binary(record_to_json(decode_rusmarc_record(), dump=True).encode('utf-8')))
+
+    def test_truncated_record(self):
+        content = record_to_binary(decode_rusmarc_record())
+        for length in range(len(content)):
+            with self.assertRaises(ValueError, msg=length):
+                record_from_binary(content[:length])
+
+    def test_trailing_bytes(self):
+        with self.assertRaises(ValueError):
+            record_from_binary(record_to_binary(decode_rusmarc_record()) + b'x')
+
+    def test_wrong_magic(self):
+        content = record_to_binary(decode_rusmarc_record())
+        with self.assertRaises(ValueError):
+            record_from_binary(b'XXX' + content[3:])
+
+    def test_unsupported_version(self):
+        content = record_to_binary(decode_rusmarc_record())
+        with self.assertRaises(ValueError):
+            record_from_binary(content[:3] + b'\x02' + content[4:])
+
+    def replace_op(self, content, position, op):
+        start = HEADER.size + position
+        return content[:start] + bytes([op]) + content[start + 1:]
+
+    def test_unknown_operation(self):
+        content = record_to_binary(decode_rusmarc_record())
+        with self.assertRaises(ValueError):
+            record_from_binary(self.replace_op(content, 0, 9))
+
+    def test_subfield_without_field(self):
+        # the first operation is control field 001
+        content = record_to_binary(decode_rusmarc_record())
+        with self.assertRaises(ValueError):
+            record_from_binary(self.replace_op(content, 0, OP_DATA_SUBFIELD))
+
+    def test_end_without_extended_subfield(self):
+        content = record_to_binary(decode_rusmarc_record())
+        with self.assertRaises(ValueError):
+            record_from_binary(self.replace_op(content, 0, OP_END))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+# encode: utf-8
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from junimarc.iso2709.index import INDEX_SUFFIX, RecordsIndex, get_records_index
+
+from . import make_iso_record, sf
+
+
+def make_records(*titles):
+    return [
+        make_iso_record([('001', 'id%s' % i), ('200', '1 ' + sf('a', title))]) for i, title in enumerate(titles)
+    ]
+
+
+class RecordsIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'records.iso')
+
+    def write_records(self, records, mtime_ns=None):
+        with open(self.path, 'wb') as fl:
+            fl.write(b''.join(records))
+        if mtime_ns is not None:
+            os.utime(self.path, ns=(mtime_ns, mtime_ns))
+
+    def get_positions(self, records):
+        positions = []
+        offset = 0
+        for record_bytes in records:
+            positions.append((offset, len(record_bytes)))
+            offset += len(record_bytes)
+        return positions
+
+    def assert_positions(self, records_index, records):
+        positions = self.get_positions(records)
+        self.assertEqual(len(records_index), len(records))
+        self.assertEqual([records_index.get_position(index) for index in range(len(records))], positions)
+        self.assertEqual([records_index.get_index(offset) for offset, length in positions], list(range(len(records))))
+
+    def test_positions(self):
+        records = make_records('a', 'bb', 'ccc')
+        self.write_records(records)
+        records_index = RecordsIndex(self.path)
+        self.assert_positions(records_index, records)
+        self.assertIsNone(records_index.get_position(3))
+        self.assertIsNone(records_index.get_index(1))
+
+    def test_sidecar_is_loaded(self):
+        records = make_records('a', 'bb', 'ccc')
+        self.write_records(records)
+        RecordsIndex(self.path).get_offsets()
+        self.assertTrue(os.path.exists(self.path + INDEX_SUFFIX))
+
+        records_index = RecordsIndex(self.path)
+        with mock.patch.object(RecordsIndex, '_build', side_effect=AssertionError('index is built again')):
+            self.assert_positions(records_index, records)
+
+    def test_appended_file_invalidates_index(self):
+        records = make_records('a', 'bb', 'ccc')
+        self.write_records(records[:2], mtime_ns=1000000000)
+        records_index = RecordsIndex(self.path)
+        self.assert_positions(records_index, records[:2])
+
+        self.write_records(records, mtime_ns=1000000000)
+        self.assert_positions(records_index, records)
+        self.assert_positions(RecordsIndex(self.path), records)
+
+    def test_rewritten_file_of_the_same_size_invalidates_index(self):
+        records = make_records('aa', 'b')
+        self.write_records(records, mtime_ns=1000000000)
+        records_index = RecordsIndex(self.path)
+        self.assert_positions(records_index, records)
+
+        records = make_records('a', 'bb')
+        self.write_records(records, mtime_ns=2000000000)
+        self.assert_positions(records_index, records)
+
+    def test_sidecar_of_other_file_is_ignored(self):
+        records = make_records('aa', 'b')
+        self.write_records(records, mtime_ns=1000000000)
+        RecordsIndex(self.path).get_offsets()
+
+        records = make_records('a', 'bb')
+        self.write_records(records, mtime_ns=2000000000)
+        self.assert_positions(RecordsIndex(self.path), records)
+
+    def test_broken_record_ends_index(self):
+        records = make_records('a', 'bb')
+        self.write_records(records + [b'xxxxx' + records[0][5:]])
+        with self.assertLogs('junimarc.iso2709.index', 'ERROR'):
+            self.assert_positions(RecordsIndex(self.path), records)
+
+    def test_index_of_path_is_shared(self):
+        self.write_records(make_records('a'))
+        self.assertIs(get_records_index(self.path), get_records_index(self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+# encode: utf-8
+import io
+import unittest
+
+from junimarc.iso2709.reader import Reader
+from junimarc.json.junimarc import record_to_json
+
+from . import RUSMARC_FIELDS, make_iso_record, sf
+
+RECORDS_FIELDS = [
+    RUSMARC_FIELDS,
+    # subfields before the first $1, short and not numeric tags in $1, $1 with control field
+    [('001', 'id2'), ('461', ' 0' + sf('a', 'before') + sf('1', '20') + sf('1', 'ab9 1') + sf('1', '0011234') +
+                      sf('1', '2001 ') + sf('a', 'linked'))],
+    # short data fields, subfields without delimiter after indicators
+    [('001', 'id3'), ('010', ''), ('300', '1'), ('320', '  '), ('330', '  text' + sf('a', 'note')), ('600', '')],
+    # control field only
+    [('001', 'id4')],
+]
+
+
+class DecodeRecordToJsonTests(unittest.TestCase):
+    def assert_same_json(self, extended_subfield_code):
+        reader = Reader(None, extended_subfield_code=extended_subfield_code, encoding='utf-8')
+        for fields in RECORDS_FIELDS:
+            record_bytes = make_iso_record(fields)
+            self.assertEqual(
+                reader.decode_record_to_json(record_bytes),
+                record_to_json(reader.decode_record(record_bytes)),
+                fields[0]
+            )
+
+    def test_same_as_record_to_json(self):
+        self.assert_same_json('')
+
+    def test_same_as_record_to_json_with_extended_subfields(self):
+        with self.assertLogs('junimarc.iso2709.reader', 'ERROR'):
+            self.assert_same_json('1')
+
+    def test_memoryview_record(self):
+        reader = Reader(None, extended_subfield_code='1', encoding='utf-8')
+        record_bytes = make_iso_record(RUSMARC_FIELDS)
+        self.assertEqual(
+            reader.decode_record_to_json(memoryview(record_bytes)),
+            reader.decode_record_to_json(record_bytes)
+        )
+
+    def test_broken_record(self):
+        reader = Reader(None, encoding='utf-8')
+        record_bytes = make_iso_record(RUSMARC_FIELDS)
+        with self.assertLogs('junimarc.iso2709.reader', 'ERROR'):
+            self.assertIsNone(reader.decode_record_to_json(record_bytes[:20]))
+
+    def test_read_json(self):
+        records_bytes = b''.join(make_iso_record(fields) for fields in RECORDS_FIELDS)
+        readers = [Reader(io.BytesIO(records_bytes), extended_subfield_code='1', encoding='utf-8') for i in range(2)]
+        with self.assertLogs('junimarc.iso2709.reader', 'ERROR'):
+            records = [record_to_json(jrecord) for jrecord in readers[0].read()]
+            json_records = list(readers[1].read_json())
+        self.assertEqual(len(json_records), len(RECORDS_FIELDS))
+        self.assertEqual(json_records, records)
+
+
+if __name__ == '__main__':
+    unittest.main()
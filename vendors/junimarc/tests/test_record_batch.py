@@ -0,0 +1,84 @@
+# encode: utf-8
+import io
+import unittest
+
+from junimarc.iso2709.reader import Reader
+from junimarc.json.junimarc import record_to_json
+from junimarc.record_batch import RecordBatch
+
+from . import RUSMARC_FIELDS, make_iso_record, sf
+
+RECORDS_FIELDS = [
+    RUSMARC_FIELDS,
+    [('001', 'id2'), ('200', '1 ' + sf('a', 'Second') + sf('a', 'Second again'))],
+    # tags bytes 120012 contain 200 at not aligned position
+    [('001', 'id3'), ('120', '  ' + sf('a', 'coded')), ('012', 'fingerprint')],
+]
+
+
+def make_reader(records_bytes=b''):
+    return Reader(io.BytesIO(records_bytes), extended_subfield_code='1', encoding='utf-8')
+
+
+def records_to_json(jrecords):
+    return [record_to_json(jrecord) for jrecord in jrecords]
+
+
+class RecordBatchTests(unittest.TestCase):
+    def setUp(self):
+        self.records_bytes = [make_iso_record(fields) for fields in RECORDS_FIELDS]
+        reader = make_reader()
+        self.jrecords = [reader.decode_record(record_bytes) for record_bytes in self.records_bytes]
+
+    def make_batch(self):
+        reader = make_reader()
+        batch = reader.make_record_batch()
+        for record_bytes in self.records_bytes:
+            self.assertTrue(reader.decode_record_to_batch(record_bytes, batch))
+        return batch
+
+    def test_decode_record_to_batch(self):
+        batch = self.make_batch()
+        self.assertEqual(len(batch), 3)
+        self.assertEqual(batch.get_fields_count(), 10)
+        self.assertEqual(records_to_json(batch.to_records()), records_to_json(self.jrecords))
+
+    def test_add_record(self):
+        batch = RecordBatch(extended_subfield_code='1')
+        for jrecord in self.jrecords:
+            batch.add_record(jrecord)
+        self.assertEqual(records_to_json(batch.to_records()), records_to_json(self.jrecords))
+
+    def test_broken_record_is_not_added(self):
+        batch = self.make_batch()
+        broken_record_bytes = make_iso_record([('001', 'id4'), ('2x0', '  ' + sf('a', 'broken'))])
+        with self.assertRaises(ValueError):
+            make_reader().decode_record_to_batch(broken_record_bytes, batch)
+        self.assertEqual(len(batch), 3)
+        self.assertEqual(batch.get_fields_count(), 10)
+
+    def test_iter_values(self):
+        batch = self.make_batch()
+        self.assertEqual(list(batch.iter_values('200', 'a')), [
+            (0, 'Война и мир'), (1, 'Second'), (1, 'Second again')
+        ])
+        self.assertEqual(list(batch.iter_values('001')), [(0, 'RU\\NLR\\1'), (1, 'id2'), (2, 'id3')])
+        self.assertEqual(list(batch.iter_values('700', 'z')), [])
+
+    def test_find_fields_of_aligned_tags(self):
+        batch = self.make_batch()
+        self.assertEqual([batch.get_tag(field_index) for field_index in batch.find_fields('200')], ['200', '200'])
+        self.assertEqual([batch.get_record_index(field_index) for field_index in batch.find_fields('012')], [2])
+
+    def test_read_record_batches(self):
+        reader = make_reader(b''.join(self.records_bytes))
+        batches = list(reader.read_record_batches(2))
+        self.assertEqual([len(batch) for batch in batches], [2, 1])
+        self.assertEqual(
+            records_to_json(jrecord for batch in batches for jrecord in batch.to_records()),
+            records_to_json(self.jrecords)
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()